@@ -0,0 +1,326 @@
+"""
+Flat, array-backed AST storage.
+
+An Arena keeps every node as one row across parallel `array` columns instead
+of one Python object per node:
+
+    kind        node kind, an index into KINDS
+    op          operator of BinaryOperation/BooleanExpression, var_type of Declaration
+    value_type  value_type of BinaryOperation/Factor
+    left        first child (list start in `children` for Block/FunctionCall)
+    right       second child (list length for Block/FunctionCall)
+    extra       third child (else block of IfStatement)
+    value       literal or identifier of Factor, identifier of Declaration/Assignment,
+                function name of FunctionCall
+
+Columns holding strings or literals store an index into the interned `values`
+table; child columns store row indices. Missing values and children are NONE.
+Children are always stored before their parents, so the rows are in a valid
+bottom-up build order.
+
+Build one straight from the parser with Parser(tokens, builder=ArenaBuilder()),
+or convert an existing tree with Arena.from_tree(root).
+"""
+import pickle
+import struct
+from array import array
+
+import ASTNodeDefs as AST
+
+KINDS = ('Block', 'Declaration', 'Assignment', 'IfStatement', 'WhileStatement',
+         'FunctionCall', 'BinaryOperation', 'BooleanExpression', 'Factor')
+(BLOCK, DECLARATION, ASSIGNMENT, IF_STATEMENT, WHILE_STATEMENT,
+ FUNCTION_CALL, BINARY_OPERATION, BOOLEAN_EXPRESSION, FACTOR) = range(len(KINDS))
+
+# Missing child or value
+NONE = -1
+
+# Column names with their array typecodes, in storage order
+COLUMNS = (('kind', 'b'), ('op', 'i'), ('value_type', 'i'), ('left', 'i'),
+           ('right', 'i'), ('extra', 'i'), ('value', 'i'), ('children', 'i'))
+
+MAGIC = b'ASTA'
+HEADER = struct.Struct('<4sI' + 'Q' * len(COLUMNS) + 'Q')
+
+
+class Arena:
+    def __init__(self):
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+        self.values = []        # interned identifiers, literals, operators and type names
+        self.value_ids = {}
+        self.spans = {}         # row -> (start, end), filled when parsing with token positions
+        self.root = NONE
+
+    def __len__(self):
+        return len(self.kind)
+
+    # Index of a value in the `values` table, adding it on first use. The key includes
+    # the type so that 1, 1.0 and True stay distinct entries.
+    def intern(self, value):
+        if value is None:
+            return NONE
+        key = (type(value), value)
+        index = self.value_ids.get(key)
+        if index is None:
+            index = self.value_ids[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def add(self, kind, op=NONE, value_type=NONE, left=NONE, right=NONE, extra=NONE, value=NONE):
+        self.kind.append(kind)
+        self.op.append(op)
+        self.value_type.append(value_type)
+        self.left.append(left)
+        self.right.append(right)
+        self.extra.append(extra)
+        self.value.append(value)
+        return len(self.kind) - 1
+
+    # Store a list of child rows in `children`, returning (start, length)
+    def add_list(self, nodes):
+        start = len(self.children)
+        self.children.extend(NONE if node is None else node for node in nodes)
+        return start, len(self.children) - start
+
+    # Look up an interned value by the index stored in a column
+    def get_value(self, index):
+        return None if index == NONE else self.values[index]
+
+    def child_list(self, index):
+        start = self.left[index]
+        return self.children[start:start + self.right[index]]
+
+    # Child rows of a node, in source order, with missing children left out
+    def children_of(self, index):
+        kind = self.kind[index]
+        if kind == BLOCK or kind == FUNCTION_CALL:
+            nodes = self.child_list(index)
+        elif kind == FACTOR:
+            return []
+        elif kind == DECLARATION or kind == ASSIGNMENT:
+            nodes = (self.left[index],)
+        elif kind == IF_STATEMENT:
+            nodes = (self.left[index], self.right[index], self.extra[index])
+        else:
+            nodes = (self.left[index], self.right[index])
+        return [node for node in nodes if node != NONE]
+
+    # Row indices of every node of one kind, found with a C-level scan of the kind column
+    def rows(self, kind):
+        kinds = self.kind.tobytes()
+        marker = bytes((kind,))
+        found = []
+        index = kinds.find(marker)
+        while index != -1:
+            found.append(index)
+            index = kinds.find(marker, index + 1)
+        return found
+
+    # Node indices reachable from `index` (default: the root), parents before children
+    def walk(self, index=None):
+        index = self.root if index is None else index
+        stack = [] if index == NONE else [index]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(self.children_of(node)))
+
+    def to_tree(self, index=None):
+        """Convert rows back into ASTNodeDefs objects, returning the node for `index`."""
+        index = self.root if index is None else index
+        if index == NONE:
+            return None
+        # Children come before parents, so a single forward pass builds every node
+        nodes = [None] * (index + 1)
+        node_at = lambda row: None if row == NONE else nodes[row]
+        get_value = self.get_value
+        for row in range(index + 1):
+            kind = self.kind[row]
+            left, right = self.left[row], self.right[row]
+            if kind == FACTOR:
+                node = AST.Factor(get_value(self.value[row]), get_value(self.value_type[row]))
+            elif kind == BINARY_OPERATION:
+                node = AST.BinaryOperation(node_at(left), get_value(self.op[row]), node_at(right),
+                                           value_type=get_value(self.value_type[row]))
+            elif kind == BOOLEAN_EXPRESSION:
+                node = AST.BooleanExpression(node_at(left), get_value(self.op[row]), node_at(right))
+            elif kind == BLOCK:
+                node = AST.Block([node_at(child) for child in self.child_list(row)])
+            elif kind == DECLARATION:
+                node = AST.Declaration(get_value(self.op[row]), get_value(self.value[row]),
+                                       node_at(left))
+            elif kind == ASSIGNMENT:
+                node = AST.Assignment(get_value(self.value[row]), node_at(left))
+            elif kind == IF_STATEMENT:
+                node = AST.IfStatement(node_at(left), node_at(right), node_at(self.extra[row]))
+            elif kind == WHILE_STATEMENT:
+                node = AST.WhileStatement(node_at(left), node_at(right))
+            else:
+                node = AST.FunctionCall(get_value(self.value[row]),
+                                        [node_at(child) for child in self.child_list(row)])
+            nodes[row] = node
+        return nodes[index]
+
+    @classmethod
+    def from_tree(cls, root):
+        """Build an arena from an ASTNodeDefs tree."""
+        builder = ArenaBuilder()
+        rows = {}
+        row_of = lambda node: None if node is None else rows[id(node)]
+        # Post-order walk with an explicit stack, so children get rows before parents
+        stack = [(root, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node is None or id(node) in rows:
+                continue
+            if not ready:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children()))
+                continue
+            if isinstance(node, AST.Factor):
+                row = builder.Factor(node.value, node.value_type)
+            elif isinstance(node, AST.BinaryOperation):
+                row = builder.BinaryOperation(row_of(node.left), node.operator, row_of(node.right),
+                                              value_type=node.value_type)
+            elif isinstance(node, AST.BooleanExpression):
+                row = builder.BooleanExpression(row_of(node.left), node.operator, row_of(node.right))
+            elif isinstance(node, AST.Block):
+                row = builder.Block([row_of(stmt) for stmt in node.statements])
+            elif isinstance(node, AST.Declaration):
+                row = builder.Declaration(node.var_type, node.identifier, row_of(node.expression))
+            elif isinstance(node, AST.Assignment):
+                row = builder.Assignment(node.identifier, row_of(node.expression))
+            elif isinstance(node, AST.IfStatement):
+                row = builder.IfStatement(row_of(node.condition), row_of(node.then_block),
+                                          row_of(node.else_block))
+            elif isinstance(node, AST.WhileStatement):
+                row = builder.WhileStatement(row_of(node.condition), row_of(node.block))
+            else:
+                row = builder.FunctionCall(node.function_name, [row_of(arg) for arg in node.arguments])
+            rows[id(node)] = row
+        return builder.finish(row_of(root))
+
+    def columns(self):
+        """Zero-copy memoryviews of the columns, e.g. for numpy.frombuffer()."""
+        return {name: memoryview(getattr(self, name)) for name, _ in COLUMNS}
+
+    def dump(self, file):
+        """Write the arena to a binary file object: a header, the raw columns, then the pickled values."""
+        sizes = [len(getattr(self, name)) for name, _ in COLUMNS]
+        file.write(HEADER.pack(MAGIC, 1, *sizes, self.root + 1))
+        for name, _ in COLUMNS:
+            file.write(getattr(self, name).tobytes())
+        pickle.dump(self.values, file)
+
+    @classmethod
+    def load(cls, buffer):
+        """
+        Load an arena written by dump() from a bytes-like object or an mmap.mmap.
+        Columns are memoryviews into the buffer rather than copies, so the buffer must
+        stay open while the arena is in use and the loaded arena is read-only.
+        """
+        view = memoryview(buffer)
+        magic, version, *sizes, root = HEADER.unpack_from(view)
+        if magic != MAGIC or version != 1:
+            raise ValueError("Not an AST arena file")
+        arena = cls()
+        offset = HEADER.size
+        for (name, typecode), size in zip(COLUMNS, sizes):
+            width = array(typecode).itemsize
+            setattr(arena, name, view[offset:offset + size * width].cast(typecode))
+            offset += size * width
+        arena.values = pickle.loads(view[offset:])
+        arena.root = root - 1
+        return arena
+
+
+class ArenaBuilder:
+    """
+    Parser builder that appends rows to an Arena instead of allocating node objects.
+    Nodes are row indices; parse() returns the Arena with `root` set.
+    """
+
+    def __init__(self, arena=None):
+        self.arena = arena if arena is not None else Arena()
+
+    def _row(self, node):
+        return NONE if node is None else node
+
+    def Assignment(self, identifier, expression):
+        arena = self.arena
+        return arena.add(ASSIGNMENT, value=arena.intern(identifier), left=self._row(expression))
+
+    def Declaration(self, var_type, identifier, expression=None):
+        arena = self.arena
+        return arena.add(DECLARATION, op=arena.intern(var_type), value=arena.intern(identifier),
+                         left=self._row(expression))
+
+    def BinaryOperation(self, left, operator, right, value_type=None):
+        arena = self.arena
+        return arena.add(BINARY_OPERATION, op=arena.intern(operator),
+                         value_type=arena.intern(value_type),
+                         left=self._row(left), right=self._row(right))
+
+    def BooleanExpression(self, left, operator, right):
+        arena = self.arena
+        return arena.add(BOOLEAN_EXPRESSION, op=arena.intern(operator),
+                         left=self._row(left), right=self._row(right))
+
+    def FunctionCall(self, function_name, arguments):
+        arena = self.arena
+        start, length = arena.add_list(arguments)
+        return arena.add(FUNCTION_CALL, value=arena.intern(function_name), left=start, right=length)
+
+    def IfStatement(self, condition, then_block, else_block=None):
+        return self.arena.add(IF_STATEMENT, left=self._row(condition), right=self._row(then_block),
+                              extra=self._row(else_block))
+
+    def WhileStatement(self, condition, block):
+        return self.arena.add(WHILE_STATEMENT, left=self._row(condition), right=self._row(block))
+
+    def Block(self, statements):
+        start, length = self.arena.add_list(statements)
+        return self.arena.add(BLOCK, left=start, right=length)
+
+    def Factor(self, value, value_type):
+        arena = self.arena
+        return arena.add(FACTOR, value=arena.intern(value), value_type=arena.intern(value_type))
+
+    def value_type(self, node):
+        if node is None:
+            return None
+        arena = self.arena
+        return arena.get_value(arena.value_type[node])
+
+    def finish(self, root):
+        self.arena.root = self._row(root)
+        return self.arena
+
+    # Build into a new Arena from here on, leaving the one already returned as it is
+    def reset(self):
+        self.arena = Arena()
+
+    # Source spans live in a side table; dump() does not write them
+    def get_span(self, node):
+        return self.arena.spans.get(node)
+
+    def set_span(self, node, span):
+        if span is not None:
+            self.arena.spans[node] = span
+
+
+class ArenaVisitor:
+    """
+    Walks an arena without recursion, calling visit_<Kind>(arena, index) for every
+    reachable node, parents before children. Kinds without a method go to generic_visit.
+    """
+
+    def visit(self, arena, index=None):
+        handlers = [getattr(self, 'visit_' + kind, self.generic_visit) for kind in KINDS]
+        kinds = arena.kind
+        for node in arena.walk(index):
+            handlers[kinds[node]](arena, node)
+
+    def generic_visit(self, arena, index):
+        pass
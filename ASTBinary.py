@@ -0,0 +1,315 @@
+"""
+Compact binary encoding of ASTNodeDefs trees.
+
+    with open('program.astb', 'wb') as file:
+        dump(tree, file)                # streamed out in chunks
+    tree = load(data)                   # bytes, bytearray, memoryview or mmap.mmap
+    tree = load(p0.map_file('program.astb'))
+
+Layout: the magic b'ASTB' and a varint format version, then every node in post-order,
+children before their parent. A node is a one-byte tag followed by its own fields:
+
+    NONE                    a missing node (None)
+    FACTOR_NAME             type, identifier
+    FACTOR_INT              type, zigzag varint
+    FACTOR_FLOAT            type, 8-byte little-endian double
+    FACTOR_TRUE/FALSE       type
+    FACTOR_NONE             type (the placeholder left by a syntax error)
+    BINARY_OPERATION        operator, type
+    BOOLEAN_EXPRESSION      operator
+    DECLARATION             type, identifier
+    ASSIGNMENT              identifier
+    FUNCTION_CALL           function name, argument count
+    BLOCK                   statement count
+    IF_STATEMENT
+    WHILE_STATEMENT
+
+Types, operators and names are varint references into a string table that both sides
+build as they go: 0 defines the next entry inline (a varint byte length and UTF-8) and
+n >= 1 is entry n - 1. The table starts out holding SEEDED, None and the usual type and
+operator names, so those take a single byte from the start. Defining strings at first
+use is what lets dump() write a tree in one pass without holding the encoding in memory.
+
+Post-order makes loading a single loop over a stack of finished nodes: a parent pops
+its children and pushes itself. load() reads straight out of the buffer through a
+memoryview, copying nothing but the strings it decodes, and neither direction recurses,
+so tree depth is not limited. The garbage collector is paused while it runs. Source
+spans are not encoded.
+"""
+import gc
+import struct
+
+import ASTNodeDefs as AST
+
+MAGIC = b'ASTB'
+FORMAT_VERSION = 1
+
+TAGS = ('NONE', 'FACTOR_NAME', 'FACTOR_INT', 'FACTOR_FLOAT', 'FACTOR_TRUE', 'FACTOR_FALSE',
+        'FACTOR_NONE', 'BINARY_OPERATION', 'BOOLEAN_EXPRESSION', 'DECLARATION', 'ASSIGNMENT',
+        'FUNCTION_CALL', 'BLOCK', 'IF_STATEMENT', 'WHILE_STATEMENT')
+(NONE, FACTOR_NAME, FACTOR_INT, FACTOR_FLOAT, FACTOR_TRUE, FACTOR_FALSE,
+ FACTOR_NONE, BINARY_OPERATION, BOOLEAN_EXPRESSION, DECLARATION, ASSIGNMENT,
+ FUNCTION_CALL, BLOCK, IF_STATEMENT, WHILE_STATEMENT) = range(len(TAGS))
+
+# Initial string table: no type, the types and the operators trees usually hold
+SEEDED = (None, 'int', 'float', 'bool', 'PLUS', 'MINUS', 'MULTIPLY', 'DIVIDE',
+          'EQ', 'NEQ', 'LESS', 'GREATER')
+
+# String reference that defines a new entry
+NEW_STRING = 0
+
+FLOAT = struct.Struct('<d')
+
+# Bytes collected before dump() hands them to the file
+CHUNK_SIZE = 1 << 16
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+class Encoder:
+    def __init__(self):
+        self.strings = {text: index for index, text in enumerate(SEEDED)}
+
+    def string(self, out, text):
+        index = self.strings.get(text)
+        if index is not None:
+            write_varint(out, index + 1)
+            return
+        self.strings[text] = len(self.strings)
+        encoded = text.encode('utf-8')
+        out.append(NEW_STRING)
+        write_varint(out, len(encoded))
+        out += encoded
+
+    def factor(self, out, node):
+        value = node.value
+        if isinstance(value, str):
+            out.append(FACTOR_NAME)
+            self.string(out, node.value_type)
+            self.string(out, value)
+        elif value is None or value is True or value is False:
+            out.append(FACTOR_NONE if value is None else FACTOR_TRUE if value else FACTOR_FALSE)
+            self.string(out, node.value_type)
+        elif isinstance(value, int):
+            out.append(FACTOR_INT)
+            self.string(out, node.value_type)
+            write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+        else:
+            out.append(FACTOR_FLOAT)
+            self.string(out, node.value_type)
+            out += FLOAT.pack(value)
+
+    def chunks(self, tree, chunk_size=CHUNK_SIZE):
+        """Yield the encoding of `tree` as bytes chunks of about chunk_size."""
+        out = bytearray(MAGIC)
+        write_varint(out, FORMAT_VERSION)
+        string = self.string
+        stack = [(tree, False)]
+        while stack:
+            node, ready = stack.pop()
+            cls = type(node)
+            if cls is AST.Factor:
+                self.factor(out, node)
+            elif node is None:
+                out.append(NONE)
+            elif not ready:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children()))
+                continue
+            elif cls is AST.BinaryOperation:
+                out.append(BINARY_OPERATION)
+                string(out, node.operator)
+                string(out, node.value_type)
+            elif cls is AST.Block:
+                out.append(BLOCK)
+                write_varint(out, len(node.statements))
+            elif cls is AST.Assignment:
+                out.append(ASSIGNMENT)
+                string(out, node.identifier)
+            elif cls is AST.Declaration:
+                out.append(DECLARATION)
+                string(out, node.var_type)
+                string(out, node.identifier)
+            elif cls is AST.BooleanExpression:
+                out.append(BOOLEAN_EXPRESSION)
+                string(out, node.operator)
+            elif cls is AST.FunctionCall:
+                out.append(FUNCTION_CALL)
+                string(out, node.function_name)
+                write_varint(out, len(node.arguments))
+            elif cls is AST.IfStatement:
+                out.append(IF_STATEMENT)
+            elif cls is AST.WhileStatement:
+                out.append(WHILE_STATEMENT)
+            else:
+                raise TypeError(f"Cannot encode {cls.__name__}")
+            if len(out) >= chunk_size:
+                yield bytes(out)
+                out.clear()
+        if out:
+            yield bytes(out)
+
+
+def dump(tree, file, chunk_size=CHUNK_SIZE):
+    """Write the encoding of `tree` to a binary file object, a chunk at a time."""
+    for chunk in Encoder().chunks(tree, chunk_size):
+        file.write(chunk)
+
+
+def dumps(tree):
+    return b''.join(Encoder().chunks(tree))
+
+
+def load(buffer):
+    """
+    Decode a tree from a bytes-like object or an mmap.mmap holding exactly one encoding.
+    Raises ValueError for anything that is not a complete encoding of this version.
+    """
+    view = memoryview(buffer)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a binary AST")
+    # Decoding allocates a node every few bytes and creates no reference cycles, so
+    # collections set off by the allocation count would only rescan the growing tree
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return decode(view, len(MAGIC))
+    except (IndexError, struct.error):
+        raise ValueError("Truncated binary AST") from None
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# Varint at `position`, returning (value, next position)
+def read_varint(view, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = view[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def decode(view, position):
+    version, position = read_varint(view, position)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary AST version {version}")
+
+    Factor = AST.Factor
+    BinaryOperation = AST.BinaryOperation
+    unpack_float = FLOAT.unpack_from
+    strings = list(SEEDED)
+
+    # String reference at `position`, returning (string, next position). The hot nodes
+    # look single-byte references up themselves and only come here for the rest.
+    def string(position):
+        ref, position = read_varint(view, position)
+        if ref != NEW_STRING:
+            return strings[ref - 1], position
+        length, position = read_varint(view, position)
+        text = str(view[position:position + length], 'utf-8')
+        strings.append(text)
+        return text, position + length
+
+    # Finished nodes; a parent replaces its children at the top with itself
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    end = len(view)
+    try:
+        while position < end:
+            tag = view[position]
+            if tag == FACTOR_NAME:
+                value_type = view[position + 1]
+                name = view[position + 2]
+                if 0 < value_type < 0x80 and 0 < name < 0x80:
+                    push(Factor(strings[name - 1], strings[value_type - 1]))
+                    position += 3
+                else:
+                    value_type, position = string(position + 1)
+                    name, position = string(position)
+                    push(Factor(name, value_type))
+            elif tag == FACTOR_INT:
+                value_type = view[position + 1]
+                if 0 < value_type < 0x80:
+                    value_type = strings[value_type - 1]
+                    position += 2
+                else:
+                    value_type, position = string(position + 1)
+                value = view[position]
+                position += 1
+                if value >= 0x80:
+                    value, position = read_varint(view, position - 1)
+                push(Factor(-((value + 1) >> 1) if value & 1 else value >> 1, value_type))
+            elif tag == BINARY_OPERATION:
+                operator = view[position + 1]
+                value_type = view[position + 2]
+                if 0 < operator < 0x80 and 0 < value_type < 0x80:
+                    operator = strings[operator - 1]
+                    value_type = strings[value_type - 1]
+                    position += 3
+                else:
+                    operator, position = string(position + 1)
+                    value_type, position = string(position)
+                right = pop()
+                stack[-1] = BinaryOperation(stack[-1], operator, right, value_type)
+            elif tag == FACTOR_FLOAT:
+                value_type, position = string(position + 1)
+                push(Factor(unpack_float(view, position)[0], value_type))
+                position += FLOAT.size
+            elif tag == ASSIGNMENT:
+                identifier, position = string(position + 1)
+                stack[-1] = AST.Assignment(identifier, stack[-1])
+            elif tag == DECLARATION:
+                var_type, position = string(position + 1)
+                identifier, position = string(position)
+                stack[-1] = AST.Declaration(var_type, identifier, stack[-1])
+            elif tag == BLOCK or tag == FUNCTION_CALL:
+                name = None
+                position += 1
+                if tag == FUNCTION_CALL:
+                    name, position = string(position)
+                count, position = read_varint(view, position)
+                if count > len(stack):
+                    raise IndexError
+                children = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                push(AST.Block(children) if tag == BLOCK else AST.FunctionCall(name, children))
+            elif tag == BOOLEAN_EXPRESSION:
+                operator, position = string(position + 1)
+                right = pop()
+                stack[-1] = AST.BooleanExpression(stack[-1], operator, right)
+            elif tag == NONE:
+                push(None)
+                position += 1
+            elif tag == IF_STATEMENT:
+                else_block = pop()
+                then_block = pop()
+                stack[-1] = AST.IfStatement(stack[-1], then_block, else_block)
+                position += 1
+            elif tag == WHILE_STATEMENT:
+                block = pop()
+                stack[-1] = AST.WhileStatement(stack[-1], block)
+                position += 1
+            elif tag == FACTOR_TRUE or tag == FACTOR_FALSE or tag == FACTOR_NONE:
+                value_type, position = string(position + 1)
+                push(Factor(None if tag == FACTOR_NONE else tag == FACTOR_TRUE, value_type))
+            else:
+                raise ValueError(f"Bad node tag {tag} at offset {position}")
+    except IndexError:
+        raise ValueError("Truncated binary AST") from None
+    if position != end or len(stack) != 1:
+        raise ValueError("Truncated binary AST" if position > end or not stack else
+                         "Binary AST does not hold exactly one tree")
+    return stack[0]
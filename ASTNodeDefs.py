@@ -1,134 +1,245 @@
-# Base class for all AST nodes
+# Base class for all AST nodes. Nodes use __slots__ instead of a per-instance __dict__,
+# which keeps large trees (millions of Factor leaves) compact.
+#
+# repr() and to_string() are produced by serialize(), which walks the tree with an
+# explicit stack and joins one list of pieces, so deep trees (long `a + b + c + ...`
+# chains) neither hit the recursion limit nor copy intermediate strings at every level.
+# Each class only describes its own text through layout().
+#
+# `span` is the node's (start, end) offsets in the source, set by a parser that was given
+# token positions, and None otherwise. It takes no part in repr() or to_string().
 class ASTNode:
+    __slots__ = ('_span',)
+
+    @property
+    def span(self):
+        return getattr(self, '_span', None)
+
+    @span.setter
+    def span(self, value):
+        self._span = value
+
+    def children(self):
+        """Direct child nodes in source order; may contain None for missing parts."""
+        return ()
+
+    def layout(self, as_repr):
+        """Pieces of this node's text: literal strings and child nodes to expand in place."""
+        return [object.__repr__(self)]
+
+    def __repr__(self):
+        return serialize(self, True)
+
     def to_string(self):
         """Method to provide compact string representation without newlines."""
-        return repr(self)
+        return serialize(self, False)
+
+
+# Render a child for layout(): nodes are expanded by serialize(), anything else
+# (including None) is turned into text with `render`.
+def _child(value, render):
+    return value if isinstance(value, ASTNode) else render(value)
+
+
+# Interleave `items` with the separator, as str.join would
+def _joined(items, separator):
+    pieces = []
+    for index, item in enumerate(items):
+        if index:
+            pieces.append(separator)
+        pieces.append(item)
+    return pieces
+
+
+def serialize(node, as_repr=False):
+    """Text of a tree: repr() when as_repr is true, to_string() otherwise."""
+    out = []
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+        else:
+            stack.extend(reversed(item.layout(as_repr)))
+    return ''.join(out)
+
 
 # Class for variable assignment: x = expression
 class Assignment(ASTNode):
+    __slots__ = ('identifier', 'expression')
+
     def __init__(self, identifier, expression):
         self.identifier = identifier
         self.expression = expression
 
-    def __repr__(self):
-        return f"Assignment({self.identifier}, {self.expression})"
+    def children(self):
+        return (self.expression,)
 
-    def to_string(self):
-        expr_str = self.expression.to_string() if isinstance(self.expression, ASTNode) else repr(self.expression)
-        return f"Assignment({self.identifier}, {expr_str})"
+    def layout(self, as_repr):
+        return [f"Assignment({self.identifier}, ", _child(self.expression, str if as_repr else repr), ")"]
 
 # Class for variable declarations: int x = expression or float x = expression
 class Declaration(ASTNode):
+    __slots__ = ('var_type', 'identifier', 'expression')
+
     def __init__(self, var_type, identifier, expression=None):
         self.var_type = var_type  # 'int' or 'float'
         self.identifier = identifier
         self.expression = expression
 
-    def __repr__(self):
-        expr_repr = repr(self.expression) if self.expression is not None else "None"
-        return f"Declaration({self.var_type}, {self.identifier}, {expr_repr})"
+    def children(self):
+        return (self.expression,)
 
-    def to_string(self):
-        expr_str = self.expression.to_string() if isinstance(self.expression, ASTNode) else repr(self.expression)
-        return f"Declaration({self.var_type}, {self.identifier}, {expr_str})"
+    def layout(self, as_repr):
+        return [f"Declaration({self.var_type}, {self.identifier}, ", _child(self.expression, repr), ")"]
 
 # Class for binary operations: term1 + term2
 class BinaryOperation(ASTNode):
+    __slots__ = ('left', 'operator', 'right', 'value_type')
+
     def __init__(self, left, operator, right, value_type=None):
         self.left = left
         self.operator = operator
         self.right = right
         self.value_type = value_type  # Type of the result of the operation (e.g., int or float)
 
-    def __repr__(self):
-        return f"BinaryOperation({self.left}, {self.operator}, {self.right}, type={self.value_type})"
+    def children(self):
+        return (self.left, self.right)
 
-    def to_string(self):
-        left_str = self.left.to_string() if isinstance(self.left, ASTNode) else repr(self.left)
-        right_str = self.right.to_string() if isinstance(self.right, ASTNode) else repr(self.right)
-        return f"BinaryOperation({left_str}, {self.operator}, {right_str}, type={self.value_type})"
+    def layout(self, as_repr):
+        render = str if as_repr else repr
+        return ["BinaryOperation(", _child(self.left, render), f", {self.operator}, ",
+                _child(self.right, render), f", type={self.value_type})"]
 
 # Class for boolean expressions: x != 10
 class BooleanExpression(ASTNode):
+    __slots__ = ('left', 'operator', 'right')
+
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
         self.right = right
 
-    def __repr__(self):
-        return f"BooleanExpression({self.left}, {self.operator}, {self.right})"
+    def children(self):
+        return (self.left, self.right)
 
-    def to_string(self):
-        left_str = self.left.to_string() if isinstance(self.left, ASTNode) else repr(self.left)
-        right_str = self.right.to_string() if isinstance(self.right, ASTNode) else repr(self.right)
-        return f"BooleanExpression({left_str}, {self.operator}, {right_str})"
+    def layout(self, as_repr):
+        render = str if as_repr else repr
+        return ["BooleanExpression(", _child(self.left, render), f", {self.operator}, ",
+                _child(self.right, render), ")"]
 
 # Class for function calls: foobar(arg1, arg2)
 class FunctionCall(ASTNode):
+    __slots__ = ('function_name', 'arguments')
+
     def __init__(self, function_name, arguments):
         self.function_name = function_name
         self.arguments = arguments
 
-    def __repr__(self):
-        args_repr = ", ".join(repr(arg) for arg in self.arguments)
-        return f"FunctionCall({self.function_name}, [{args_repr}])"
+    def children(self):
+        return self.arguments
 
-    def to_string(self):
-        args_str = ", ".join(arg.to_string() if isinstance(arg, ASTNode) else repr(arg) for arg in self.arguments)
-        return f"FunctionCall({self.function_name}, [{args_str}])"
+    def layout(self, as_repr):
+        args = _joined([_child(arg, repr) for arg in self.arguments], ", ")
+        return [f"FunctionCall({self.function_name}, [", *args, "])"]
 
 # Class for if statements
 class IfStatement(ASTNode):
+    __slots__ = ('condition', 'then_block', 'else_block')
+
     def __init__(self, condition, then_block, else_block=None):
         self.condition = condition
         self.then_block = then_block
         self.else_block = else_block
 
-    def __repr__(self):
-        else_repr = repr(self.else_block) if self.else_block is not None else "None"
-        return f"IfStatement({self.condition}, {self.then_block}, {else_repr})"
+    def children(self):
+        return (self.condition, self.then_block, self.else_block)
 
-    def to_string(self):
-        condition_str = self.condition.to_string() if isinstance(self.condition, ASTNode) else repr(self.condition)
-        then_str = self.then_block.to_string() if isinstance(self.then_block, ASTNode) else repr(self.then_block)
-        else_str = self.else_block.to_string() if self.else_block is not None else "None"
-        return f"IfStatement({condition_str}, {then_str}, {else_str})"
+    def layout(self, as_repr):
+        render = str if as_repr else repr
+        return ["IfStatement(", _child(self.condition, render), ", ", _child(self.then_block, render),
+                ", ", _child(self.else_block, repr), ")"]
 
 # Class for while statements
 class WhileStatement(ASTNode):
+    __slots__ = ('condition', 'block')
+
     def __init__(self, condition, block):
         self.condition = condition
         self.block = block
 
-    def __repr__(self):
-        return f"WhileStatement({self.condition}, {self.block})"
+    def children(self):
+        return (self.condition, self.block)
 
-    def to_string(self):
-        condition_str = self.condition.to_string() if isinstance(self.condition, ASTNode) else repr(self.condition)
-        block_str = self.block.to_string() if isinstance(self.block, ASTNode) else repr(self.block)
-        return f"WhileStatement({condition_str}, {block_str})"
+    def layout(self, as_repr):
+        render = str if as_repr else repr
+        return ["WhileStatement(", _child(self.condition, render), ", ", _child(self.block, render), ")"]
 
 # Class for blocks
 class Block(ASTNode):
+    __slots__ = ('statements',)
+
     def __init__(self, statements):
         self.statements = statements
 
-    def __repr__(self):
-        statement_reprs = "\n  ".join(repr(statement) for statement in self.statements)
-        return f"Block(\n  {statement_reprs}\n)"
+    def children(self):
+        return self.statements
 
-    def to_string(self):
-        statement_strs = ", ".join(stmt.to_string() if isinstance(stmt, ASTNode) else repr(stmt) for stmt in self.statements)
-        return f"Block([{statement_strs}])"
+    def layout(self, as_repr):
+        statements = [_child(statement, repr) for statement in self.statements]
+        if as_repr:
+            return ["Block(\n  ", *_joined(statements, "\n  "), "\n)"]
+        return ["Block([", *_joined(statements, ", "), "])"]
 
 # Class for factors (literals or variables) in expressions
 class Factor(ASTNode):
+    __slots__ = ('value', 'value_type')
+
     def __init__(self, value, value_type):
         self.value = value
         self.value_type = value_type  # 'int', 'float', or other types as needed
 
-    def __repr__(self):
-        return f"Factor(value={self.value}, type={self.value_type})"
-
-    def to_string(self):
-        return f"Factor(value={self.value}, type={self.value_type})"
+    def layout(self, as_repr):
+        return [f"Factor(value={self.value}, type={self.value_type})"]
+
+
+def walk(node):
+    """Yield every node of a tree, parents before children, without recursion."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child for child in reversed(node.children()) if isinstance(child, ASTNode))
+
+
+class NodeVisitor:
+    """
+    Iterative tree walker. traverse(root) calls visit_<ClassName>(node) before a node's
+    children and leave_<ClassName>(node) after them, falling back to generic_visit and
+    generic_leave. An explicit stack replaces recursion, so tree depth is not limited
+    by the interpreter's recursion limit.
+    """
+
+    def traverse(self, root):
+        handlers = {}
+        stack = [(root, False)]
+        while stack:
+            node, leaving = stack.pop()
+            cls = type(node)
+            if cls not in handlers:
+                name = cls.__name__
+                handlers[cls] = (getattr(self, 'visit_' + name, self.generic_visit),
+                                 getattr(self, 'leave_' + name, self.generic_leave))
+            if leaving:
+                handlers[cls][1](node)
+                continue
+            handlers[cls][0](node)
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children())
+                         if isinstance(child, ASTNode))
+
+    def generic_visit(self, node):
+        pass
+
+    def generic_leave(self, node):
+        pass
@@ -0,0 +1,176 @@
+"""
+Parsing from asyncio code without blocking the event loop.
+
+    service = ParseService(max_workers=4, max_in_flight=16, timeout=2.0)
+    ast, messages = await service.parse(source)
+    ast, messages = await service.parse(source, timeout=None)   # no timeout for this call
+    service.close()
+
+    ast, messages = await parse_async(source)     # shared service with default settings
+
+Lexing and parsing run through BatchParse.parse_source in a thread pool, or in a process
+pool with executor='process'. Threads cost nothing per request but share the GIL with
+the event loop, so the loop stays responsive rather than running at full speed; processes
+parse in parallel at the price of sending every tree back, in ASTBinary format as
+parse_many does, and decoding it on the loop.
+
+    backpressure    at most `max_in_flight` parses are queued or running in the pool at
+                    once; further requests wait for a slot. A slot is only given back
+                    when the pool is done with the job, so abandoned work still counts.
+    timeouts        each call waits at most `timeout` seconds, slot included, then raises
+                    TimeoutError
+    deduplication   concurrent calls for the same source share one parse. Each caller can
+                    time out or be cancelled on its own; the parse is cancelled once the
+                    last of them is gone, which frees its slot unless it already started.
+
+Results are shared between the callers of a deduplicated parse, so as with ParseCache
+the tree must be treated as read-only; every caller gets its own messages list.
+"""
+import asyncio
+import concurrent.futures
+import os
+
+from BatchParse import OUTPUTS, _decode, _parse_chunk
+
+EXECUTORS = {'thread': concurrent.futures.ThreadPoolExecutor,
+             'process': concurrent.futures.ProcessPoolExecutor}
+
+# Default for parse(timeout=...): use the service's timeout
+SERVICE_TIMEOUT = object()
+
+
+# One parse and the number of callers waiting for it
+class Job:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class ParseService:
+    def __init__(self, max_workers=None, max_in_flight=None, timeout=None, executor='thread',
+                 output='tree', lexer_mode='fast'):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output format: {output}")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self.timeout = timeout
+        self.executor = executor
+        self.output = output
+        self.lexer_mode = lexer_mode
+        self.requests = 0
+        self.shared = 0         # requests that joined a parse already in flight
+        self.timeouts = 0
+        self.cancelled = 0
+        self.in_flight = 0      # parses holding a slot
+        self.closed = False
+        self._pool = None       # created on first use
+        self._loop = None
+        self._slots = None
+        self._jobs = {}         # source -> Job
+
+    async def parse(self, source, timeout=SERVICE_TIMEOUT):
+        """Return (ast, messages) for `source`, parsed in the pool."""
+        if self.closed:
+            raise RuntimeError("ParseService is closed")
+        if timeout is SERVICE_TIMEOUT:
+            timeout = self.timeout
+        self._bind()
+        self.requests += 1
+        job = self._jobs.get(source)
+        if job is None:
+            job = self._jobs[source] = Job(asyncio.ensure_future(self._run(source)))
+            job.task.add_done_callback(lambda task: self._forget(source, job))
+        else:
+            self.shared += 1
+        job.waiters += 1
+        try:
+            ast, messages = await asyncio.wait_for(asyncio.shield(job.task), timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            job.waiters -= 1
+            if not job.waiters and not job.task.done():
+                self._forget(source, job)
+                job.task.cancel()
+        return ast, list(messages)
+
+    def stats(self):
+        return {'requests': self.requests, 'shared': self.shared, 'timeouts': self.timeouts,
+                'cancelled': self.cancelled, 'in_flight': self.in_flight}
+
+    def close(self):
+        """Cancel the parses that have not started and shut the pool down without waiting."""
+        self.closed = True
+        for job in list(self._jobs.values()):
+            job.task.cancel()
+        self._jobs.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    # The slots and the job map belong to one event loop; a service used from a new loop
+    # (after another asyncio.run(), say) starts over with fresh ones
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._jobs = {}
+            self.in_flight = 0
+
+    def _forget(self, source, job):
+        if self._jobs.get(source) is job:
+            del self._jobs[source]
+
+    # Parse `source` in the pool once a slot is free
+    async def _run(self, source):
+        await self._slots.acquire()
+        try:
+            if self._pool is None:
+                self._pool = EXECUTORS[self.executor](max_workers=self.max_workers)
+            # Trees from a process are encoded, since pickling a deep one hits the recursion limit
+            encode = self.executor == 'process' and self.output == 'tree'
+            future = self._pool.submit(_parse_chunk, [source], self.output, self.lexer_mode, encode)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.in_flight += 1
+        loop, slots = self._loop, self._slots
+        future.add_done_callback(lambda future: self._release(loop, slots))
+        results = await asyncio.wrap_future(future)
+        return (_decode(results) if encode else results)[0]
+
+    # Give a slot back from whichever thread finished the job
+    def _release(self, loop, slots):
+        def release():
+            if slots is self._slots:
+                self.in_flight -= 1
+            slots.release()
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:
+            pass    # the loop is gone, and its slots with it
+
+
+_default_service = None
+
+
+async def parse_async(source, timeout=None):
+    """Parse `source` on a thread-pool ParseService shared by all callers."""
+    global _default_service
+    if _default_service is None:
+        _default_service = ParseService()
+    return await _default_service.parse(source, timeout)
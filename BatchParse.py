@@ -0,0 +1,212 @@
+"""
+Batch parsing of many independent programs across a process pool.
+
+    results = parse_many(sources, workers=8)
+    for ast, messages in results:
+        ...
+
+    ast, messages = parse_parallel(huge_source, workers=8)    # one program, split up
+
+Results come back in input order. Programs are sent to the workers in chunks
+so that one round trip carries many files, and trees come back in the ASTBinary
+format, which unlike pickle has no depth limit. A program that fails to lex or parse
+(for example a ValueError from Lexer.number) gives (None, messages) with the
+error appended to its messages instead of stopping the batch.
+
+parse_parallel() parses one large program in pieces. It cuts the source before
+top-level statements (see plan_pieces) and parses every piece in a worker, seeded
+with the global declarations the statements before it make. Only the global scope
+lives across top-level statements, and globals are first-wins (a redeclaration is
+reported and ignored), so a piece parsed with the right globals gives exactly the
+statements and messages the serial parse gives for it. Trees come back in the
+ASTBinary format, which loads several times faster than pickle.
+
+The seeds come from a quick scan of the text and are checked afterwards against the
+declarations the workers actually made. The pieces are only stitched together if
+every seed was right and no piece had a syntax or lexer error, which could shift
+the statement boundaries, or enough messages to reach the parser's error cap.
+Otherwise the program is parsed serially, so the result is always identical to
+parse_source(). Decoding the pieces' trees is left to the calling process, where it
+overlaps with the parsing of later pieces and takes about a third of the time a serial
+parse would.
+"""
+import concurrent.futures
+import functools
+import os
+import re
+
+import ASTBinary
+import ASTNodeDefs as AST
+import Parser as p0
+from ASTArena import ArenaBuilder
+
+# Output formats accepted by parse_source/parse_many
+OUTPUTS = ('tree', 'arena')
+
+
+def parse_source(source, output='tree', lexer_mode='fast'):
+    """Lex and parse one program, returning (ast, messages)."""
+    if output not in OUTPUTS:
+        raise ValueError(f"Unknown output format: {output}")
+    parser = None
+    try:
+        builder = ArenaBuilder() if output == 'arena' else None
+        parser = p0.Parser(p0.Lexer(source, mode=lexer_mode).iter_tokens(), builder=builder)
+        return parser.parse(), parser.messages
+    except Exception as exc:
+        messages = parser.messages if parser is not None else []
+        messages.append(f"{type(exc).__name__}: {exc}")
+        return None, messages
+
+
+# Worker entry point: parse one chunk of sources. With `encode`, trees are returned in
+# ASTBinary format, which neither side recurses over, so a deep tree gets back to the
+# parent where pickling it would hit the recursion limit and lose the whole chunk.
+def _parse_chunk(sources, output, lexer_mode, encode=False):
+    results = []
+    for source in sources:
+        ast, messages = parse_source(source, output, lexer_mode)
+        if encode and ast is not None:
+            try:
+                ast = ASTBinary.dumps(ast)
+            except Exception as exc:
+                ast = None
+                messages.append(f"{type(exc).__name__}: {exc}")
+        results.append((ast, messages))
+    return results
+
+
+# Load the trees in results from _parse_chunk(encode=True)
+def _decode(results):
+    return [(None if ast is None else ASTBinary.load(ast), messages) for ast, messages in results]
+
+
+def parse_many(sources, workers=None, chunksize=None, output='tree', lexer_mode='fast'):
+    """
+    Parse independent programs in a process pool and return one (ast, messages)
+    pair per source, in input order.
+
+    `workers` defaults to the CPU count; with one worker everything runs in this
+    process. `chunksize` is the number of sources per task and defaults to about
+    four tasks per worker. Trees come back in ASTBinary format and are decoded
+    here, so they can be as deep as the parser allows; arenas are pickled.
+    """
+    if output not in OUTPUTS:
+        raise ValueError(f"Unknown output format: {output}")
+    sources = list(sources)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(sources) <= 1:
+        return _parse_chunk(sources, output, lexer_mode)
+
+    if chunksize is None:
+        chunksize = max(1, -(-len(sources) // (workers * 4)))
+    chunks = [sources[start:start + chunksize] for start in range(0, len(sources), chunksize)]
+    encode = output == 'tree'
+    task = functools.partial(_parse_chunk, output=output, lexer_mode=lexer_mode, encode=encode)
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        for chunk_results in pool.map(task, chunks):
+            results.extend(_decode(chunk_results) if encode else chunk_results)
+    return results
+
+
+# Keyword starting a line, with the declared name for int and float. Pieces are cut
+# before these; statements that start elsewhere on a line are never cut before.
+STATEMENT_START = re.compile(r'^[ \t]*(int|float|if|while)(?![A-Za-z0-9_])'
+                             r'(?:[ \t]+([A-Za-z][A-Za-z0-9_]*))?', re.MULTILINE)
+STATEMENT_START_BYTES = re.compile(STATEMENT_START.pattern.encode('ascii'), re.MULTILINE)
+
+# Pieces are at least this many characters, so small programs are parsed in one go
+MIN_PIECE_SIZE = 1 << 16
+
+
+def plan_pieces(source, piece_size):
+    """
+    Cut points for parse_parallel and the globals expected before each piece.
+
+    Returns (starts, seeds): piece i is source[starts[i]:starts[i + 1]] and seeds[i] is
+    the list of (name, type) global declarations, first wins, made before it. Cuts are
+    made at lines starting with int, float, if or while outside any braces, at least
+    `piece_size` characters apart. Braces only ever lex as brace tokens, so counting
+    them gives the nesting depth.
+    """
+    text = isinstance(source, str)
+    pattern = STATEMENT_START if text else STATEMENT_START_BYTES
+    lbrace, rbrace = ('{', '}') if text else (b'{', b'}')
+    starts, seeds = [0], [[]]
+    declared = {}
+    depth = 0
+    last = 0
+    for match in pattern.finditer(source):
+        position = match.start(1)
+        depth += source.count(lbrace, last, position) - source.count(rbrace, last, position)
+        last = position
+        if depth:
+            continue
+        if position - starts[-1] >= piece_size:
+            starts.append(position)
+            seeds.append(list(declared.items()))
+        keyword, name = match.group(1, 2)
+        if name is not None and keyword in ('int', 'float', b'int', b'float'):
+            if not text:
+                keyword, name = keyword.decode('ascii'), name.decode('ascii')
+            declared.setdefault(name, keyword)
+    return starts, seeds
+
+
+# Worker entry point: parse one piece with the globals declared before it. Returns the
+# tree in ASTBinary format, the messages, the number of syntax errors and the globals the
+# piece declared itself, or None if the piece fails to lex or parse.
+def _parse_piece(source, seed, lexer_mode):
+    try:
+        parser = p0.Parser(p0.Lexer(source, mode=lexer_mode).iter_tokens(), max_errors=None)
+        for name, var_type in seed:
+            parser.add_variable(name, var_type)
+        tree = parser.parse()
+    except Exception:
+        return None
+    declared = list(parser.symbol_table['global'].items())[len(seed):]
+    return ASTBinary.dumps(tree), parser.messages, parser.syntax_errors, declared
+
+
+def parse_parallel(source, workers=None, piece_size=None, lexer_mode='fast'):
+    """
+    Parse one program (str or bytes) in pieces across a process pool and return
+    (ast, messages), the same as parse_source(source) would.
+
+    `workers` defaults to the CPU count. `piece_size` is the minimum piece length and
+    defaults to about four pieces per worker, but no less than MIN_PIECE_SIZE.
+    """
+    workers = workers or os.cpu_count() or 1
+    if piece_size is None:
+        piece_size = max(MIN_PIECE_SIZE, -(-len(source) // (workers * 4)))
+    starts, seeds = plan_pieces(source, piece_size) if workers > 1 else ([0], [[]])
+    if len(starts) == 1:
+        return parse_source(source, lexer_mode=lexer_mode)
+
+    ends = starts[1:] + [len(source)]
+    pieces = [source[start:end] for start, end in zip(starts, ends)]
+    task = functools.partial(_parse_piece, lexer_mode=lexer_mode)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pieces))) as pool:
+        result = _stitch(seeds, pool.map(task, pieces, seeds))
+        if result is None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    if result is None or len(result[1]) >= p0.MAX_ERRORS:
+        return parse_source(source, lexer_mode=lexer_mode)
+    return result
+
+
+# Join the pieces' results into one (Block, messages) as they arrive, decoding each while
+# the later ones are still being parsed. None if any piece cannot be used as it is.
+def _stitch(seeds, results):
+    statements = []
+    messages = []
+    declared = {}
+    for seed, result in zip(seeds, results):
+        if result is None or result[2] or dict(seed) != declared:
+            return None
+        data, piece_messages, _, piece_declared = result
+        statements.extend(ASTBinary.load(data).statements)
+        messages.extend(piece_messages)
+        declared.update(piece_declared)
+    return AST.Block(statements), messages
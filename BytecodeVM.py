@@ -0,0 +1,607 @@
+"""
+Bytecode compiler and stack VM for executing parsed programs.
+
+    tree = Parser(tokens).parse()
+    program = Compiler().compile(tree)
+    vm = VM()
+    variables = vm.run(program)     # {global name: final value}
+    vm.output                       # [(function name, arguments), ...] of builtin calls
+
+The compiler resolves every variable to a slot in one flat frame at compile time, so the
+VM never looks a name up. Block scopes only decide which slot a name refers to; a slot is
+reused once the block that declared it has ended. Constants sit in the frame after the
+variables, so one LOAD fetches either. Code is an array of (opcode, argument) word pairs,
+the argument being a frame index, instruction index or call-site index depending on the
+opcode.
+
+The VM keeps the top of the stack in a local variable, the accumulator, and only spills
+to the stack list what is below it: LOAD replaces the accumulator, PUSH_LOAD saves it
+first, and an operator combines the popped left operand with it. Arithmetic whose right
+operand is a variable or literal takes it straight from the frame (ADD_INT_LOAD and so
+on), which saves a push and a dispatch per operation.
+
+Execution follows the types the checker recorded in value_type:
+
+    int             a 64-bit signed integer: results wrap around on overflow, as in C,
+                    and division truncates toward zero
+    arithmetic      an operation runs in its own value_type; an operand of the other type
+                    is converted first
+    stores          a value of the other type is converted to the variable's declared type
+    redeclarations  a second declaration of a name in the same scope keeps the first one,
+                    as the checker does: its value, of its own declared type, is stored
+                    into the first binding like an assignment
+    comparisons     compare the two values as they are
+
+The compiler raises CompileError for trees it cannot give a meaning to: syntax error
+placeholders, undeclared variables, and expressions without a value_type (a tree from
+SyntaxParser that SemanticAnalyzer has not typed yet). Type mismatches are allowed and
+follow the conversions above. A condition may also be a Factor of type 'bool', which is
+what Optimizer leaves of a comparison between literals.
+
+Running a program raises ExecutionError for what only shows at run time: a division by
+zero, or converting an infinite or NaN float to int. Optimizer leaves divisions by a
+literal zero unfolded, so these are raised when the division runs.
+
+Function calls go to the VM's builtins, a mapping from name to callable. The default
+builtins (print, log, emit) record each call in vm.output instead of printing.
+
+TreeInterpreter runs a tree directly with the same semantics. It walks the tree
+recursively and keeps variables in a chain of dicts, and serves as the reference and
+baseline in bench_vm.py.
+"""
+from array import array
+
+import ASTNodeDefs as AST
+
+# Opcodes. Every instruction is two words, (opcode, argument); operators that only work
+# on the stack ignore the argument. The VM tests them in this order, most frequent first.
+OPCODES = ('LOAD', 'STORE', 'PUSH_LOAD', 'ADD_INT_LOAD', 'SUB_INT_LOAD', 'MUL_INT_LOAD', 'DIV_INT_LOAD',
+           'ADD_FLOAT_LOAD', 'SUB_FLOAT_LOAD', 'MUL_FLOAT_LOAD', 'DIV_FLOAT_LOAD',
+           'ADD_INT', 'SUB_INT', 'MUL_INT', 'ADD_FLOAT', 'SUB_FLOAT', 'MUL_FLOAT',
+           'JUMP_UNLESS_LESS', 'JUMP_UNLESS_GREATER', 'JUMP_UNLESS_EQ', 'JUMP_UNLESS_NEQ',
+           'JUMP', 'CALL', 'DIV_INT', 'DIV_FLOAT', 'TO_INT', 'TO_FLOAT', 'PUSH')
+(LOAD, STORE, PUSH_LOAD, ADD_INT_LOAD, SUB_INT_LOAD, MUL_INT_LOAD, DIV_INT_LOAD,
+ ADD_FLOAT_LOAD, SUB_FLOAT_LOAD, MUL_FLOAT_LOAD, DIV_FLOAT_LOAD,
+ ADD_INT, SUB_INT, MUL_INT, ADD_FLOAT, SUB_FLOAT, MUL_FLOAT,
+ JUMP_UNLESS_LESS, JUMP_UNLESS_GREATER, JUMP_UNLESS_EQ, JUMP_UNLESS_NEQ,
+ JUMP, CALL, DIV_INT, DIV_FLOAT, TO_INT, TO_FLOAT, PUSH) = range(len(OPCODES))
+
+# Arithmetic opcodes by value_type and operator, taking the right operand from the stack
+ARITHMETIC = {
+    'int': {'PLUS': ADD_INT, 'MINUS': SUB_INT, 'MULTIPLY': MUL_INT, 'DIVIDE': DIV_INT},
+    'float': {'PLUS': ADD_FLOAT, 'MINUS': SUB_FLOAT, 'MULTIPLY': MUL_FLOAT, 'DIVIDE': DIV_FLOAT},
+}
+# ... and taking it from the frame
+ARITHMETIC_LOAD = {
+    'int': {'PLUS': ADD_INT_LOAD, 'MINUS': SUB_INT_LOAD, 'MULTIPLY': MUL_INT_LOAD,
+            'DIVIDE': DIV_INT_LOAD},
+    'float': {'PLUS': ADD_FLOAT_LOAD, 'MINUS': SUB_FLOAT_LOAD, 'MULTIPLY': MUL_FLOAT_LOAD,
+              'DIVIDE': DIV_FLOAT_LOAD},
+}
+JUMP_UNLESS = {'LESS': JUMP_UNLESS_LESS, 'GREATER': JUMP_UNLESS_GREATER,
+               'EQ': JUMP_UNLESS_EQ, 'NEQ': JUMP_UNLESS_NEQ}
+CONVERSIONS = {'int': TO_INT, 'float': TO_FLOAT}
+ZERO = {'int': 0, 'float': 0.0}
+
+# Functions the default builtins provide
+BUILTIN_NAMES = ('print', 'log', 'emit')
+
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+
+class CompileError(ValueError):
+    pass
+
+
+class ExecutionError(RuntimeError):
+    pass
+
+
+# Exceptions the arithmetic raises while a program runs: ZeroDivisionError, and
+# OverflowError or ValueError from int() of an infinite or NaN float
+ARITHMETIC_ERRORS = (ZeroDivisionError, OverflowError, ValueError)
+
+
+# The ExecutionError reported for one of ARITHMETIC_ERRORS
+def execution_error(error):
+    if isinstance(error, ZeroDivisionError):
+        return ExecutionError("Division by zero")
+    return ExecutionError("Cannot convert an infinite or NaN float to int")
+
+
+# Reduce an integer to the 64-bit two's complement range
+def wrap_int(value):
+    if INT_MIN <= value <= INT_MAX:
+        return value
+    return (value - INT_MIN) % 2 ** 64 + INT_MIN
+
+
+# Integer division truncating toward zero, as in C
+def int_divide(left, right):
+    quotient = left // right
+    if quotient < 0 and quotient * right != left:
+        quotient += 1
+    return wrap_int(quotient)
+
+
+def convert(value, var_type):
+    return wrap_int(int(value)) if var_type == 'int' else float(value)
+
+
+# Value of `left operator right` with both operands already of value_type
+def arithmetic(operator, value_type, left, right):
+    if operator == 'DIVIDE':
+        return int_divide(left, right) if value_type == 'int' else left / right
+    if operator == 'PLUS':
+        value = left + right
+    elif operator == 'MINUS':
+        value = left - right
+    else:
+        value = left * right
+    return wrap_int(value) if value_type == 'int' else value
+
+
+def compare(operator, left, right):
+    if operator == 'LESS':
+        return left < right
+    if operator == 'GREATER':
+        return left > right
+    if operator == 'EQ':
+        return left == right
+    return left != right
+
+
+# Builtins that append (name, arguments) to `output` for every call
+def recording_builtins(output, names=BUILTIN_NAMES):
+    def recorder(name):
+        def call(*args):
+            output.append((name, args))
+        return call
+    return {name: recorder(name) for name in names}
+
+
+# Position in the code, placed once; jumps emitted before that are patched when it is
+class Label:
+    __slots__ = ('position', 'uses')
+
+    def __init__(self):
+        self.position = None
+        self.uses = []
+
+
+class Program:
+    def __init__(self, code, constants, calls, frame_size, variables):
+        self.code = code                # array('q') of (opcode, argument) pairs
+        self.constants = constants      # frame entries frame_size onwards
+        self.calls = calls              # (function name, argument count) per call site
+        self.frame_size = frame_size    # variable slots
+        self.variables = variables      # global name -> slot, as bound at the end
+
+    def disassemble(self):
+        lines = []
+        for pc in range(0, len(self.code), 2):
+            op, arg = self.code[pc], self.code[pc + 1]
+            name = OPCODES[op]
+            if op == CALL:
+                detail = f" {arg} ({self.calls[arg][0]}/{self.calls[arg][1]})"
+            elif name.endswith('LOAD') or op == STORE:
+                constant = arg - self.frame_size
+                detail = f" {arg} ({self.constants[constant]!r})" if constant >= 0 else f" {arg}"
+            elif op == JUMP or name.startswith('JUMP_UNLESS'):
+                detail = f" {arg}"
+            else:
+                detail = ''
+            lines.append(f"{pc // 2:6} {name}{detail}")
+        return '\n'.join(lines)
+
+
+class Compiler:
+    """
+    Compiles a checked tree into a Program. The tree is walked with an explicit work
+    stack holding nodes to expand, instructions to emit, labels to place and scope
+    actions to run, so deep trees do not hit the recursion limit.
+    """
+
+    def __init__(self):
+        self.code = array('q')
+        self.constants = []
+        self.constant_index = {}
+        self.constant_uses = []  # code positions holding a constant index
+        self.last_push = None   # code position of the last PUSH
+        self.calls = []
+        self.call_index = {}
+        self.scopes = [{}]      # name -> (slot, var_type), innermost last
+        self.scope_starts = []  # first slot of each nested scope
+        self.next_slot = 0
+        self.frame_size = 0
+        self.root = None
+
+    def compile(self, tree):
+        self.root = tree
+        handlers = {}
+        work = [tree]
+        while work:
+            item = work.pop()
+            if isinstance(item, AST.ASTNode):
+                cls = type(item)
+                if cls not in handlers:
+                    handlers[cls] = getattr(self, 'compile_' + cls.__name__)
+                work.extend(reversed(handlers[cls](item)))
+            elif isinstance(item, tuple):
+                self.emit(*item)
+            elif isinstance(item, Label):
+                self.place(item)
+            elif item is None:
+                raise CompileError("Cannot compile a tree with syntax errors")
+            else:
+                item()
+        # Constants go after the variable slots, whose number is only known now
+        for use in self.constant_uses:
+            self.code[use] += self.frame_size
+        variables = {name: slot for name, (slot, _) in self.scopes[0].items()}
+        return Program(self.code, self.constants, self.calls, self.frame_size, variables)
+
+    # Append one instruction. `constant` marks the argument as an index into the constants.
+    # A LOAD straight after a PUSH is merged into it as PUSH_LOAD.
+    def emit(self, op, arg=0, constant=False):
+        if op == PUSH:
+            self.last_push = len(self.code)
+        elif op == LOAD and self.last_push == len(self.code) - 2:
+            del self.code[-2:]
+            op = PUSH_LOAD
+        if constant:
+            self.constant_uses.append(len(self.code) + 1)
+        elif isinstance(arg, Label):
+            if arg.position is None:
+                arg.uses.append(len(self.code) + 1)
+                arg = 0
+            else:
+                arg = arg.position
+        self.code.append(op)
+        self.code.append(arg)
+
+    def place(self, label):
+        label.position = len(self.code) // 2
+        for use in label.uses:
+            self.code[use] = label.position
+
+    # Index of a constant; the key includes the type so that 1 and 1.0 stay distinct
+    def constant(self, value):
+        key = (type(value), value)
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def call_site(self, name, count):
+        key = (name, count)
+        index = self.call_index.get(key)
+        if index is None:
+            index = self.call_index[key] = len(self.calls)
+            self.calls.append(key)
+        return index
+
+    def enter_scope(self):
+        self.scopes.append({})
+        self.scope_starts.append(self.next_slot)
+
+    def exit_scope(self):
+        self.scopes.pop()
+        self.next_slot = self.scope_starts.pop()
+
+    # Bind a declared name to a fresh slot and store the value on the stack in it
+    def declare(self, name, var_type):
+        slot = self.next_slot
+        self.next_slot += 1
+        self.frame_size = max(self.frame_size, self.next_slot)
+        self.scopes[-1][name] = (slot, var_type)
+        self.emit(STORE, slot)
+
+    def resolve(self, name):
+        for scope in reversed(self.scopes):
+            binding = scope.get(name)
+            if binding is not None:
+                return binding
+        raise CompileError(f"Variable {name} has not been declared in the current or any enclosing scopes")
+
+    # Items computing `node` as a value of `var_type`
+    def typed(self, node, var_type):
+        if node is None:
+            raise CompileError("Cannot compile a tree with syntax errors")
+        if node.value_type is None:
+            raise CompileError(f"Expression has no type: {node.to_string()}")
+        if node.value_type == var_type:
+            return [node]
+        return [node, (CONVERSIONS[var_type], 0)]
+
+    # The program's own block is the global scope; every other block has its own
+    def compile_Block(self, node):
+        if node is self.root:
+            return node.statements
+        return [self.enter_scope, *node.statements, self.exit_scope]
+
+    # The initializer is compiled before the name is bound, so it sees the outer binding.
+    # A redeclaration in the same scope keeps the first binding, as the checker does, and
+    # stores the value into it.
+    def compile_Declaration(self, node):
+        if node.expression is None:
+            items = [(LOAD, self.constant(ZERO[node.var_type]), True)]
+        else:
+            items = self.typed(node.expression, node.var_type)
+        binding = self.scopes[-1].get(node.identifier)
+        if binding is None:
+            return items + [lambda: self.declare(node.identifier, node.var_type)]
+        slot, var_type = binding
+        if var_type != node.var_type:
+            items.append((CONVERSIONS[var_type], 0))
+        return items + [(STORE, slot)]
+
+    def compile_Assignment(self, node):
+        slot, var_type = self.resolve(node.identifier)
+        return self.typed(node.expression, var_type) + [(STORE, slot)]
+
+    # Every argument but the last ends up on the stack, the last one in the accumulator
+    def compile_FunctionCall(self, node):
+        items = []
+        for argument in node.arguments:
+            if argument is None:
+                raise CompileError("Cannot compile a tree with syntax errors")
+            if items:
+                items.append((PUSH, 0))
+            items.append(argument)
+        return items + [(CALL, self.call_site(node.function_name, len(node.arguments)))]
+
+    # Items that jump to `target` unless the condition holds. A bool Factor is a condition
+    # Optimizer already decided.
+    def condition(self, node, target):
+        if isinstance(node, AST.Factor) and node.value_type == 'bool':
+            return [] if node.value else [(JUMP, target)]
+        if not isinstance(node, AST.BooleanExpression) or node.operator not in JUMP_UNLESS:
+            raise CompileError("Cannot compile a tree with syntax errors")
+        return [*self.typed(node.left, node.left.value_type), (PUSH, 0),
+                *self.typed(node.right, node.right.value_type), (JUMP_UNLESS[node.operator], target)]
+
+    def compile_IfStatement(self, node):
+        otherwise = Label()
+        items = [*self.condition(node.condition, otherwise), node.then_block]
+        if node.else_block is None:
+            return items + [otherwise]
+        end = Label()
+        return items + [(JUMP, end), otherwise, node.else_block, end]
+
+    def compile_WhileStatement(self, node):
+        top = Label()
+        end = Label()
+        return [top, *self.condition(node.condition, end), node.block, (JUMP, top), end]
+
+    def compile_BinaryOperation(self, node):
+        value_type = node.value_type
+        right = node.right
+        if isinstance(right, AST.Factor) and right.value_type == value_type:
+            # The right operand is loaded by the operation itself
+            _, index, constant = self.compile_Factor(right)[0]
+            return [*self.typed(node.left, value_type),
+                    (ARITHMETIC_LOAD[value_type][node.operator], index, constant)]
+        return [*self.typed(node.left, value_type), (PUSH, 0), *self.typed(right, value_type),
+                (ARITHMETIC[value_type][node.operator], 0)]
+
+    def compile_Factor(self, node):
+        if node.value is None:
+            raise CompileError("Cannot compile a tree with syntax errors")
+        if isinstance(node.value, str):
+            return [(LOAD, self.resolve(node.value)[0], False)]
+        value = wrap_int(node.value) if node.value_type == 'int' else node.value
+        return [(LOAD, self.constant(value), True)]
+
+
+class VM:
+    def __init__(self, builtins=None):
+        self.output = []
+        self.builtins = recording_builtins(self.output) if builtins is None else builtins
+
+    def run(self, program):
+        """Execute a Program and return the final values of its global variables."""
+        functions = []
+        for name, count in program.calls:
+            if name not in self.builtins:
+                raise ExecutionError(f"Unknown function: {name}")
+            functions.append((self.builtins[name], count))
+        code = program.code
+        try:
+            frame = self.execute(list(zip(code[::2], code[1::2])),
+                                 [0] * program.frame_size + program.constants, functions)
+        except ARITHMETIC_ERRORS as error:
+            raise execution_error(error) from error
+        return {name: frame[slot] for name, slot in program.variables.items()}
+
+    # The dispatch loop, over the code as a list of (opcode, argument) tuples. Everything
+    # it touches is a local, and each opcode is one branch of a single if chain ordered
+    # by how often generated programs execute it.
+    @staticmethod
+    def execute(code, frame, functions):
+        low, high = INT_MIN, INT_MAX
+        acc = 0
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        end = len(code)
+        while pc < end:
+            op, arg = code[pc]
+            pc += 1
+            if op == LOAD:
+                acc = frame[arg]
+            elif op == STORE:
+                frame[arg] = acc
+            elif op == PUSH_LOAD:
+                push(acc)
+                acc = frame[arg]
+            elif op == ADD_INT_LOAD:
+                acc += frame[arg]
+                if not low <= acc <= high:
+                    acc = wrap_int(acc)
+            elif op == SUB_INT_LOAD:
+                acc -= frame[arg]
+                if not low <= acc <= high:
+                    acc = wrap_int(acc)
+            elif op == MUL_INT_LOAD:
+                acc *= frame[arg]
+                if not low <= acc <= high:
+                    acc = wrap_int(acc)
+            elif op == DIV_INT_LOAD:
+                acc = int_divide(acc, frame[arg])
+            elif op == ADD_FLOAT_LOAD:
+                acc += frame[arg]
+            elif op == SUB_FLOAT_LOAD:
+                acc -= frame[arg]
+            elif op == MUL_FLOAT_LOAD:
+                acc *= frame[arg]
+            elif op == DIV_FLOAT_LOAD:
+                acc /= frame[arg]
+            elif op == ADD_INT:
+                acc += pop()
+                if not low <= acc <= high:
+                    acc = wrap_int(acc)
+            elif op == SUB_INT:
+                acc = pop() - acc
+                if not low <= acc <= high:
+                    acc = wrap_int(acc)
+            elif op == MUL_INT:
+                acc *= pop()
+                if not low <= acc <= high:
+                    acc = wrap_int(acc)
+            elif op == ADD_FLOAT:
+                acc = pop() + acc
+            elif op == SUB_FLOAT:
+                acc = pop() - acc
+            elif op == MUL_FLOAT:
+                acc = pop() * acc
+            elif op == JUMP_UNLESS_LESS:
+                if not pop() < acc:
+                    pc = arg
+            elif op == JUMP_UNLESS_GREATER:
+                if not pop() > acc:
+                    pc = arg
+            elif op == JUMP_UNLESS_EQ:
+                if not pop() == acc:
+                    pc = arg
+            elif op == JUMP_UNLESS_NEQ:
+                if not pop() != acc:
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == CALL:
+                function, count = functions[arg]
+                if count > 1:
+                    args = stack[1 - count:]
+                    del stack[1 - count:]
+                    function(*args, acc)
+                elif count:
+                    function(acc)
+                else:
+                    function()
+            elif op == DIV_INT:
+                acc = int_divide(pop(), acc)
+            elif op == DIV_FLOAT:
+                acc = pop() / acc
+            elif op == TO_INT:
+                acc = wrap_int(int(acc))
+            elif op == TO_FLOAT:
+                acc = float(acc)
+            elif op == PUSH:
+                push(acc)
+            else:
+                raise ExecutionError(f"Bad opcode {op} at {pc - 1}")
+        return frame
+
+
+class TreeInterpreter:
+    """
+    Runs a tree directly, with the same semantics and results as Compiler + VM. Variables
+    live in a chain of dicts (name -> [var_type, value]) searched at every use.
+    """
+
+    def __init__(self, builtins=None):
+        self.output = []
+        self.builtins = recording_builtins(self.output) if builtins is None else builtins
+        self.scopes = [{}]
+
+    def run(self, tree):
+        self.scopes = [{}]
+        try:
+            for statement in tree.statements:
+                self.execute(statement)
+        except ARITHMETIC_ERRORS as error:
+            raise execution_error(error) from error
+        return {name: value for name, (_, value) in self.scopes[0].items()}
+
+    def execute(self, node):
+        if node is None:
+            raise ExecutionError("Cannot run a tree with syntax errors")
+        getattr(self, 'execute_' + type(node).__name__)(node)
+
+    def binding(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        raise ExecutionError(f"Variable {name} has not been declared in the current or any enclosing scopes")
+
+    def execute_Block(self, node):
+        self.scopes.append({})
+        try:
+            for statement in node.statements:
+                self.execute(statement)
+        finally:
+            self.scopes.pop()
+
+    def execute_Declaration(self, node):
+        if node.expression is None:
+            value = ZERO[node.var_type]
+        else:
+            value = self.typed(node.expression, node.var_type)
+        binding = self.scopes[-1].get(node.identifier)
+        if binding is None:
+            self.scopes[-1][node.identifier] = [node.var_type, value]
+        else:
+            binding[1] = value if binding[0] == node.var_type else convert(value, binding[0])
+
+    def execute_Assignment(self, node):
+        binding = self.binding(node.identifier)
+        binding[1] = self.typed(node.expression, binding[0])
+
+    def execute_FunctionCall(self, node):
+        function = self.builtins.get(node.function_name)
+        if function is None:
+            raise ExecutionError(f"Unknown function: {node.function_name}")
+        function(*[self.evaluate(argument) for argument in node.arguments])
+
+    def execute_IfStatement(self, node):
+        if self.test(node.condition):
+            self.execute(node.then_block)
+        elif node.else_block is not None:
+            self.execute(node.else_block)
+
+    def execute_WhileStatement(self, node):
+        while self.test(node.condition):
+            self.execute(node.block)
+
+    def test(self, node):
+        if isinstance(node, AST.Factor):
+            return node.value
+        return compare(node.operator, self.evaluate(node.left), self.evaluate(node.right))
+
+    def typed(self, node, var_type):
+        value = self.evaluate(node)
+        return value if node.value_type == var_type else convert(value, var_type)
+
+    def evaluate(self, node):
+        if isinstance(node, AST.Factor):
+            if isinstance(node.value, str):
+                return self.binding(node.value)[1]
+            return wrap_int(node.value) if node.value_type == 'int' else node.value
+        value_type = node.value_type
+        return arithmetic(node.operator, value_type, self.typed(node.left, value_type),
+                          self.typed(node.right, value_type))
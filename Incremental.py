@@ -0,0 +1,214 @@
+"""
+Incremental reparsing for editor integrations.
+
+    document = IncrementalParser(source)
+    ast, messages = document.edit(start, end, new_text)
+
+An edit replaces source[start:end] with new_text. Only the tokens around the
+edit are re-lexed: lexing restarts at the first top-level statement that can
+be affected and stops as soon as a token lines up with an old token past the
+edited text, since everything after that point lexes identically.
+
+Parsing restarts at that statement from a checkpoint of the symbol-table state
+taken at every top-level statement boundary. At the top level the only live
+scope is 'global', and global declarations are only ever appended, so a
+checkpoint is just the number of globals declared before the statement. As soon
+as the new parse reaches an old statement boundary past the edit with the same
+globals in scope, the remaining statements and their messages are reused as
+they are.
+
+Lexing and parsing work therefore tracks the size of the edit. The token and
+per-statement lists are spliced in place, so what comes before the edit is never
+copied, and token offsets are kept relative to the end of the source past the
+last edit (see Offsets), so what comes after it is not shifted either.
+"""
+import bisect
+import itertools
+
+import Parser as p0
+
+
+# Lex code[position:], yielding (token, start, end) for every token up to and including EOF
+def lex_spans(code, position=0):
+    if not code:
+        yield ('EOF', None), 0, 0
+        return
+    lexer = p0.Lexer(code, mode='fast', positions=True)
+    for index, token in enumerate(lexer.iter_tokens(position)):
+        yield token, lexer.starts[index], lexer.ends[index]
+
+
+# Replace items[start:stop] with `new` and add `shift` to every item after them, in place
+def splice(items, start, stop, new, shift=0):
+    items[start:stop] = new
+    if shift:
+        tail = start + len(new)
+        items[tail:] = map(shift.__add__, items[tail:])
+
+
+# Source offsets of the tokens, stored so that an edit leaves the offsets after it alone.
+# Items before `gap` hold the offset itself and items from `gap` on hold it minus the
+# source length, which stays the same however much the text ahead of it grows or
+# shrinks. Only the items between the gap and the next edit are ever rewritten, so
+# edits near each other cost nothing for the rest of the file.
+class Offsets:
+    def __init__(self, offsets, length):
+        self.items = list(offsets)
+        self.length = length
+        self.gap = len(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        item = self.items[index]
+        return item if index < self.gap else item + self.length
+
+    # Index of the first offset >= value; both sides of the gap are sorted
+    def bisect(self, value):
+        index = bisect.bisect_left(self.items, value, 0, self.gap)
+        if index == self.gap:
+            index = bisect.bisect_left(self.items, value - self.length, self.gap)
+        return index
+
+    # Replace the offsets of tokens [start, stop) with `new`, in a source now `length` long
+    def replace(self, start, stop, new, length):
+        items = self.items
+        if start < self.gap:
+            items[start:self.gap] = map((-self.length).__add__, items[start:self.gap])
+        else:
+            items[self.gap:start] = map(self.length.__add__, items[self.gap:start])
+        items[start:stop] = new
+        self.gap = start + len(new)
+        self.length = length
+
+
+class IncrementalParser:
+    def __init__(self, source):
+        self.source = source
+        self.tokens, starts, ends = [], [], []
+        for token, start, end in lex_spans(source):
+            self.tokens.append(token)
+            starts.append(start)
+            ends.append(end)
+        self.starts = Offsets(starts, len(source))
+        self.ends = Offsets(ends, len(source))
+        # One entry per top-level statement: the statement, its first token index and
+        # the checkpoint taken before it (message count, global count, scope counter)
+        self.statements = []
+        self.first_tokens = []
+        self.messages_before = []
+        self.globals_before = []
+        self.scopes_before = []
+        self.messages = []
+        self.globals = []       # (name, type) of the global declarations, in order
+        self.reused = 0         # statements reused by the last edit
+        self._parse_from(0, 0)
+
+    @property
+    def ast(self):
+        return p0.TreeBuilder.Block(list(self.statements))
+
+    def edit(self, start, end, text):
+        """Replace source[start:end] with text and return the updated (ast, messages)."""
+        source = self.source[:start] + text + self.source[end:]
+        delta = len(text) - (end - start)
+        edit_end = start + len(text)
+
+        # The first token touching the edit may change, and so may the statement
+        # before it, whose end was decided by looking at that token
+        first = min(self.ends.bisect(start), len(self.tokens) - 1)
+        statement = self._statement_of(max(first - 1, 0))
+        relex_from = self.first_tokens[statement] if statement < len(self.statements) else 0
+
+        # Re-lex until a token lines up with an unchanged old token past the edit. An edit
+        # in the whitespace ahead of the first token starts before any token does.
+        tokens, starts, ends = [], [], []
+        old = first
+        resync = len(self.tokens)
+        for token, token_start, token_end in lex_spans(source, min(start, self.starts[relex_from])):
+            if token_start >= edit_end:
+                while old < len(self.tokens) and (self.starts[old] < end or
+                                                  self.starts[old] + delta < token_start):
+                    old += 1
+                if old < len(self.tokens) and self.starts[old] + delta == token_start:
+                    resync = old
+                    break
+            tokens.append(token)
+            starts.append(token_start)
+            ends.append(token_end)
+
+        new_resync = relex_from + len(tokens)
+        self.tokens[relex_from:resync] = tokens
+        self._parse_from(statement, new_resync, new_resync - resync)
+        self.source = source
+        self.starts.replace(relex_from, resync, starts, len(source))
+        self.ends.replace(relex_from, resync, ends, len(source))
+        return self.ast, self.messages
+
+    # Index of the top-level statement containing a token
+    def _statement_of(self, token_index):
+        low, high = 0, len(self.first_tokens) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.first_tokens[middle] <= token_index:
+                low = middle
+            else:
+                high = middle - 1
+        return max(low, 0)
+
+    # Reparse self.tokens from top-level statement `index` using the checkpoint taken
+    # before it. Once the parse reaches a token at or past `resync` that begins an old
+    # statement (`shift` tokens further on than it used to) with the same globals in
+    # scope, that statement and the ones after it are spliced back in.
+    def _parse_from(self, index, resync, shift=0):
+        restart = index < len(self.statements)
+        # No error cap: a cap would make messages depend on statements the edit never reached
+        parser = p0.Parser(p0.TokenStream(self.tokens, self.first_tokens[index] if restart else 0),
+                           max_errors=None)
+        if restart:
+            for name, var_type in self.globals[:self.globals_before[index]]:
+                parser.add_variable(name, var_type)
+            parser.scope_counter = self.scopes_before[index]
+            parser.messages = self.messages[:self.messages_before[index]]
+        matched = self.globals_before[index] if restart else 0
+        global_scope = parser.symbol_table['global']
+
+        statements, first_tokens, messages_before, globals_before, scopes_before = [], [], [], [], []
+        stop = len(self.statements)     # old statements [index, stop) are replaced
+        message_shift = scope_shift = 0
+        diverged = False
+        while parser.current_token[0] != 'EOF':
+            position = parser.tokens.position - 1
+            if position >= resync and not diverged and self.statements:
+                old = self._statement_of(position - shift)
+                if self.first_tokens[old] == position - shift and \
+                        len(global_scope) == self.globals_before[old]:
+                    # Globals only grow, so once they differ from the old ones they stay different
+                    if list(itertools.islice(global_scope.items(), matched, None)) != \
+                            self.globals[matched:len(global_scope)]:
+                        diverged = True
+                    else:
+                        # Same tokens and same symbols from here on: splice in the old tail
+                        stop = old
+                        message_shift = len(parser.messages) - self.messages_before[old]
+                        scope_shift = parser.scope_counter - self.scopes_before[old]
+                        parser.messages += self.messages[self.messages_before[old]:]
+                        break
+
+            first_tokens.append(position)
+            messages_before.append(len(parser.messages))
+            globals_before.append(len(global_scope))
+            scopes_before.append(parser.scope_counter)
+            statements.append(parser.next_statement())
+
+        # After a splice the globals are exactly the old ones
+        self.reused = len(self.statements) - stop
+        if not self.reused:
+            self.globals = list(global_scope.items())
+        self.statements[index:stop] = statements
+        splice(self.first_tokens, index, stop, first_tokens, shift)
+        splice(self.messages_before, index, stop, messages_before, message_shift)
+        self.globals_before[index:stop] = globals_before
+        splice(self.scopes_before, index, stop, scopes_before, scope_shift)
+        self.messages = parser.messages
@@ -0,0 +1,263 @@
+"""
+Constant folding and reassociation over checked trees.
+
+    optimizer = Optimizer()
+    smaller = optimizer.optimize(tree)
+    print(optimizer.report())       # nodes: 1200 -> 950 (-20.8%), ...
+
+The pass rewrites expressions bottom-up, once per node:
+
+    folding         a BinaryOperation or BooleanExpression whose operands are literals
+                    becomes one Factor: `2.0 * 3.5 * x` turns into `7.0 * x`, and a
+                    comparison between literals into a Factor of type 'bool'
+    reassociation   a left-deep chain of int + and - (or of int *) collects its
+                    literals into one at the end: `x + 2 + y - 5` turns into `x + y - 3`,
+                    and x + 0 or x * 1 into x
+    types           the value_type of every rebuilt operation is its left operand's, the
+                    rule Parser uses, computed from the already rewritten children
+
+Values follow BytecodeVM's semantics (wrapping 64-bit ints, truncating division) through
+its own arithmetic helpers, so a program runs exactly the same before and after. For
+that reason only operations whose operands have the operation's own type are touched,
+division by a literal zero is left for run time, float results that are not finite stay
+unfolded, and float chains are never reassociated, since float addition and
+multiplication are not associative.
+
+The input tree is never modified. Changed nodes are copies and unchanged subtrees are
+shared with the input, so trees held by ParseCache or IncrementalParser stay intact.
+Rewritten nodes keep the span of the node they replace.
+"""
+import copy
+import math
+
+import ASTNodeDefs as AST
+from BytecodeVM import INT_MIN, arithmetic, compare, wrap_int
+
+OPERATIONS = (AST.BinaryOperation, AST.BooleanExpression)
+ADDITIVE = ('PLUS', 'MINUS')
+
+
+def is_literal(node):
+    return isinstance(node, AST.Factor) and node.value is not None and not isinstance(node.value, str)
+
+
+class Optimizer:
+    def __init__(self):
+        self.nodes_before = 0
+        self.nodes_after = 0
+        self.folded = 0         # operations replaced by a literal
+        self.reassociated = 0   # chains rebuilt with their literals combined
+        self.removed = 0        # nodes removed by the current optimize()
+
+    def optimize(self, tree):
+        """Return the optimized tree; `tree` itself is left as it is."""
+        self.removed = 0
+        before = self.nodes_before
+        # Post-order walk over the statements that contain blocks; everything else is a
+        # leaf here and its expressions are rewritten on the spot
+        results = []
+        stack = [(tree, False)]
+        while stack:
+            node, ready = stack.pop()
+            cls = type(node)
+            if cls is AST.Block:
+                nested = node.statements
+            elif cls is AST.IfStatement:
+                nested = (node.then_block, node.else_block)
+            elif cls is AST.WhileStatement:
+                nested = (node.block,)
+            else:
+                results.append(self.simple_statement(node))
+                continue
+            if not ready:
+                self.nodes_before += 1
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(nested))
+                continue
+            children = results[len(results) - len(nested):]
+            del results[len(results) - len(nested):]
+            if cls is AST.Block:
+                if any(new is not old for new, old in zip(children, nested)):
+                    block = AST.Block(children)
+                    block.span = node.span
+                    node = block
+                results.append(node)
+                continue
+            condition = self.expression(node.condition)
+            if condition is not node.condition or any(new is not old for new, old in zip(children, nested)):
+                node = copy.copy(node)
+                node.condition = condition
+                if cls is AST.IfStatement:
+                    node.then_block, node.else_block = children
+                else:
+                    node.block = children[0]
+            results.append(node)
+        self.nodes_after += self.nodes_before - before - self.removed
+        return results[0]
+
+    def report(self):
+        saved = self.nodes_before - self.nodes_after
+        percent = 100 * saved / self.nodes_before if self.nodes_before else 0.0
+        return (f"nodes: {self.nodes_before} -> {self.nodes_after} (-{percent:.1f}%), "
+                f"{self.folded} operations folded, {self.reassociated} chains reassociated")
+
+    def simple_statement(self, node):
+        if node is None:
+            return None
+        self.nodes_before += 1
+        if isinstance(node, AST.FunctionCall):
+            arguments = [self.expression(argument) for argument in node.arguments]
+            if any(new is not old for new, old in zip(arguments, node.arguments)):
+                node = copy.copy(node)
+                node.arguments = arguments
+            return node
+        expression = self.expression(node.expression)
+        if expression is not node.expression:
+            node = copy.copy(node)
+            node.expression = expression
+        return node
+
+    # Rewrite one expression tree bottom-up. Only operations go on the stack; an operation
+    # inside a chain is only folded, and the chain is reassociated as a whole from its
+    # last operation, which keeps the pass linear in the size of the tree.
+    def expression(self, root):
+        if not isinstance(root, OPERATIONS):
+            self.nodes_before += root is not None
+            return root
+        results = []
+        stack = [(root, False, False)]
+        while stack:
+            node, ready, inside_chain = stack.pop()
+            left, right = node.left, node.right
+            if not ready:
+                self.nodes_before += 1
+                stack.append((node, True, inside_chain))
+                if isinstance(right, OPERATIONS):
+                    stack.append((right, False, False))
+                else:
+                    self.nodes_before += right is not None
+                if isinstance(left, OPERATIONS):
+                    stack.append((left, False, self.chain_link(node) and
+                                  self.family(left) == self.family(node)))
+                else:
+                    self.nodes_before += left is not None
+                continue
+            new_right = results.pop() if isinstance(right, OPERATIONS) else right
+            new_left = results.pop() if isinstance(left, OPERATIONS) else left
+            if new_left is not left or new_right is not right:
+                node = copy.copy(node)
+                node.left, node.right = new_left, new_right
+            if type(node) is AST.BinaryOperation:
+                results.append(self.binary_operation(node, inside_chain))
+            else:
+                results.append(self.boolean_expression(node))
+        return results[0]
+
+    # A literal Factor replacing `node`
+    def literal(self, node, value, value_type):
+        factor = AST.Factor(value, value_type)
+        factor.span = node.span
+        self.folded += 1
+        self.removed += 2
+        return factor
+
+    def binary_operation(self, node, inside_chain):
+        left, right = node.left, node.right
+        if left is None or right is None:
+            return node
+        value_type = left.value_type
+        if node.value_type != value_type:
+            node = copy.copy(node)
+            node.value_type = value_type
+        if value_type is None or right.value_type != value_type:
+            return node
+        if is_literal(left) and is_literal(right):
+            if node.operator == 'DIVIDE' and right.value == 0:
+                return node
+            value = arithmetic(node.operator, value_type, self.value(left), self.value(right))
+            if value_type == 'float' and not math.isfinite(value):
+                return node
+            return self.literal(node, value, value_type)
+        if not inside_chain and self.chain_link(node):
+            return self.reassociate(node)
+        return node
+
+    def boolean_expression(self, node):
+        left, right = node.left, node.right
+        if is_literal(left) and is_literal(right) and left.value_type == right.value_type:
+            return self.literal(node, compare(node.operator, self.value(left), self.value(right)), 'bool')
+        return node
+
+    # Literal value as the VM sees it
+    @staticmethod
+    def value(factor):
+        return wrap_int(factor.value) if factor.value_type == 'int' else factor.value
+
+    # 'add' for + and -, 'multiply' for *, None for anything else
+    @staticmethod
+    def family(node):
+        if not isinstance(node, AST.BinaryOperation):
+            return None
+        if node.operator in ADDITIVE:
+            return 'add'
+        return 'multiply' if node.operator == 'MULTIPLY' else None
+
+    # Whether `node` is an int operation of a chain that may be reassociated
+    def chain_link(self, node):
+        return self.family(node) is not None and node.value_type == 'int' and \
+            node.right is not None and node.right.value_type == 'int'
+
+    # Terms of the chain ending at `node`, as (negated, operand) pairs in source order
+    def chain_terms(self, node):
+        family = self.family(node)
+        terms = []
+        while self.chain_link(node) and self.family(node) == family:
+            terms.append((node.operator == 'MINUS', node.right))
+            node = node.left
+        terms.append((False, node))
+        terms.reverse()
+        return terms
+
+    # Rebuild an int chain with its literals combined into one, if that saves nodes
+    def reassociate(self, node):
+        multiply = node.operator == 'MULTIPLY'
+        terms = self.chain_terms(node)
+        if any(operand is None or operand.value_type != 'int' for _, operand in terms):
+            return node
+        constant = 1 if multiply else 0
+        operands = []
+        for negated, operand in terms:
+            if is_literal(operand):
+                value = self.value(operand)
+                constant = wrap_int(constant * value if multiply else
+                                    constant - value if negated else constant + value)
+            else:
+                operands.append((negated, operand))
+
+        if not operands:
+            # Literals only, which folding already took care of unless they were converted
+            return node
+        # The literal leads when the first operand is subtracted, as there is no unary minus
+        leading = operands[0][0]
+        needed = leading or constant != (1 if multiply else 0)
+        if len(operands) + needed >= len(terms):
+            return node
+
+        self.reassociated += 1
+        self.removed += 2 * (len(terms) - len(operands) - needed)
+        if leading:
+            result = AST.Factor(constant, 'int')
+        else:
+            result = operands.pop(0)[1]
+        for negated, operand in operands:
+            result = AST.BinaryOperation(result, 'MINUS' if negated else
+                                         'MULTIPLY' if multiply else 'PLUS', operand, 'int')
+        if needed and not leading:
+            if multiply:
+                result = AST.BinaryOperation(result, 'MULTIPLY', AST.Factor(constant, 'int'), 'int')
+            elif constant < 0 and constant != INT_MIN:
+                result = AST.BinaryOperation(result, 'MINUS', AST.Factor(-constant, 'int'), 'int')
+            else:
+                result = AST.BinaryOperation(result, 'PLUS', AST.Factor(constant, 'int'), 'int')
+        result.span = node.span
+        return result
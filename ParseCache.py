@@ -0,0 +1,106 @@
+"""
+Content-addressed cache in front of Lexer + Parser.
+
+    cache = ParseCache(max_entries=4096, directory='.parse-cache')
+    ast, messages = cache.parse(source)
+
+Entries are keyed by a SHA-256 of the source text together with
+Parser.PARSER_VERSION and the output format, so a parser change never serves
+stale results. Results live in an in-memory LRU bounded by `max_entries` and,
+when `directory` is given, in one pickle file per entry so that warm runs in
+later processes skip lexing and parsing entirely. Only point `directory` at a
+location you trust: loading a pickle can run arbitrary code.
+
+Cached ASTs are shared between callers and must be treated as read-only.
+"""
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+
+import Parser as p0
+from BatchParse import parse_source
+
+
+class ParseCache:
+    def __init__(self, max_entries=1024, directory=None, output='tree', lexer_mode='fast'):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.output = output
+        self.lexer_mode = lexer_mode
+        self.entries = collections.OrderedDict()     # key -> (ast, messages), oldest first
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, source):
+        prefix = f"{p0.PARSER_VERSION}\0{self.output}\0".encode()
+        return hashlib.sha256(prefix + source.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def parse(self, source):
+        """Return (ast, messages) for `source`, parsing it only on a cache miss."""
+        key = self.key(source)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            entry = self._load(key)
+            if entry is not None:
+                self.hits += 1
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                entry = parse_source(source, self.output, self.lexer_mode)
+                self._store(key, entry)
+            self._remember(key, entry)
+        ast, messages = entry
+        return ast, list(messages)
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries)}
+
+    def clear(self):
+        """Drop the in-memory entries; files on disk are kept."""
+        self.entries.clear()
+
+    # Add to the in-memory LRU, evicting the least recently used entries over the bound
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    # Read an entry from disk; unreadable or corrupt files count as a miss
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    # Write an entry to disk atomically. The disk store is best effort: an entry that
+    # cannot be pickled (e.g. a tree too deep for pickle) just stays in memory.
+    def _store(self, key, entry):
+        if self.directory is None:
+            return
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except (OSError, RecursionError, pickle.PicklingError):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
@@ -1,33 +1,175 @@
+import bisect
+import collections
+import itertools
+import mmap
+import operator
+import os
+import re
+import sys
+from array import array
+
 import ASTNodeDefs as AST
 
 
+# Version of the token/AST/message output. Bump it whenever a change alters what
+# parsing a program produces, so caches keyed on it (see ParseCache) are invalidated.
+PARSER_VERSION = 4
+
+# Modes accepted by Lexer(code, mode=...)
+LEXER_MODES = ('standard', 'fast')
+
+KEYWORDS = {'if': 'IF', 'else': 'ELSE', 'while': 'WHILE', 'int': 'INT', 'float': 'FLOAT'}
+
+# Lexeme pattern for the fast lexer. Whitespace is whatever the pattern skips over, so the
+# last alternative catches every other single character (exactly the ASCII characters for
+# which str.isspace() is false) and nothing can be dropped silently. Numbers are matched
+# greedily over digits and dots, just like Lexer.number(), and validated afterwards.
+FAST_LEXEME = re.compile(
+    r'[A-Za-z][A-Za-z0-9_]*|[0-9.]+|==|!=|[^\t\n\x0b\x0c\r\x1c-\x1f ]')
+
+# Lexemes whose token does not depend on anything but their text.
+FIXED_TOKENS = {
+    '+': ('PLUS', '+'), '-': ('MINUS', '-'), '*': ('MULTIPLY', '*'), '/': ('DIVIDE', '/'),
+    '=': ('EQUALS', '='), '==': ('EQ', '=='), '!=': ('NEQ', '!='),
+    '<': ('LESS', '<'), '>': ('GREATER', '>'),
+    '(': ('LPAREN', '('), ')': ('RPAREN', ')'), ',': ('COMMA', ','), ':': ('COLON', ':'),
+    '{': ('LBRACE', '{'), '}': ('RBRACE', '}'),
+}
+FIXED_TOKENS.update((word, (kind, word)) for word, kind in KEYWORDS.items())
+
+# The same pattern and table for bytes input
+FAST_LEXEME_BYTES = re.compile(FAST_LEXEME.pattern.encode('ascii'))
+FIXED_BYTE_TOKENS = {text.encode('ascii'): token for text, token in FIXED_TOKENS.items()}
+
+
+# Character view of a bytes-like buffer for the reference scanner: indexing gives a
+# one-character str. Source bytes are ASCII, so a non-ASCII byte reads as U+FFFD, which
+# the scanner reports as an illegal character.
+class ByteChars:
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, index):
+        byte = self.buffer[index]
+        return chr(byte) if byte < 128 else '\ufffd'
+
+
+# Read-only memory map of a file. Empty files cannot be mapped and give b''.
+def map_file(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 class Lexer:
-    def __init__(self, code):
+    # With positions=True the lexer also records where every token it produces starts and
+    # ends, as offsets into the code kept in the parallel arrays `starts` and `ends`
+    # (index i belongs to the i-th token from tokenize() or iter_tokens()).
+    # `profiler` is an optional Profiling.Profiler that times this lexer.
+    #
+    # `code` is a str, a bytes-like buffer of ASCII source (bytes, memoryview, mmap.mmap)
+    # or an os.PathLike path, which is memory-mapped. Buffers are scanned in place and only
+    # lexemes such as identifiers and numbers are decoded, so a large file never has to be
+    # read into one str. Use mode='fast' for them: the reference scanner reads a buffer
+    # through a per-character view.
+    #
+    # A lexer can be reused for any number of inputs through reset(code), so a pool can
+    # keep one per thread. Instances are not safe to share between threads at once.
+    def __init__(self, code, mode='standard', positions=False, profiler=None):
+        if mode not in LEXER_MODES:
+            raise ValueError(f"Unknown lexer mode: {mode}")
+        self.mode = mode
+        self.positions = positions
+        self.mapping = None
+        self.text = True
+        self.reset(code)
+        if profiler is not None:
+            profiler.attach_lexer(self)
+
+    # Switch to new code, keeping the mode, positions and profiler settings. The previous
+    # input is released as by close(); tokens already produced stay valid.
+    def reset(self, code):
+        self.close()
+        if isinstance(code, os.PathLike):
+            code = self.mapping = map_file(code)
         self.code = code
-        self.position = 0
-        self.current_char = self.code[self.position]
+        self.text = isinstance(code, str)
+        self.chars = code if self.text else ByteChars(memoryview(code).cast('B'))
+        self.lines = None
+        self.restart()
+
+    # LineIndex of the code, built on first use, to turn token offsets and Diagnostic spans
+    # into lines and columns
+    def line_index(self):
+        if self.lines is None:
+            self.lines = LineIndex(self.code)
+        return self.lines
+
+    # Go back to `position`, by default the start of the code, with no tokens or positions
+    # recorded. New lists are made rather than old ones cleared, as they may be in use as
+    # earlier results.
+    def restart(self, position=0):
         self.tokens = []
+        self.starts = array('q')
+        self.ends = array('q')
+        self.seek(position)
+
+    # Lex a file through a read-only memory map. Call close() (or use the lexer in a with
+    # statement) to release the mapping once done with the lexer.
+    @classmethod
+    def from_file(cls, path, mode='fast', positions=False, profiler=None):
+        buffer = map_file(path)
+        try:
+            lexer = cls(buffer, mode, positions, profiler)
+        except BaseException:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+            raise
+        lexer.mapping = buffer
+        return lexer
+
+    # Release a memory-mapped input. Tokens already produced stay valid.
+    def close(self):
+        if not self.text:
+            self.chars.buffer.release()
+        self.chars = self.code = ''
+        self.text = True
+        self.current_char = None
+        if isinstance(self.mapping, mmap.mmap):
+            self.mapping.close()
+        self.mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     # Move to the next position in the code increment by one.
     def advance(self):
         self.position += 1
-        if self.position >= len(self.code):
+        if self.position >= len(self.chars):
             self.current_char = None
         else:
-            self.current_char = self.code[self.position]
+            self.current_char = self.chars[self.position]
 
     # If the current char is whitespace, move ahead.
     def skip_whitespace(self):
         while self.current_char is not None and self.current_char.isspace():
             self.advance()
 
-    # Tokenize the identifier.
+    # Tokenize the identifier. Names are interned, so every occurrence of a name in any
+    # token, AST node or symbol table is one shared str.
     def identifier(self):
         result = ''
         while self.current_char is not None and (self.current_char.isalnum() or self.current_char == '_'):
             result += self.current_char
             self.advance()
-        return ('IDENTIFIER', result)
+        return ('IDENTIFIER', sys.intern(result))
 
     # Tokenize numbers, including float handling
     def number(self):
@@ -132,45 +274,446 @@ class Lexer:
 
         return ('EOF', None)
 
-    # Collect all the tokens in a list.
-    def tokenize(self):
+    # Jump to an absolute position in the code.
+    def seek(self, position):
+        self.position = position
+        if position >= len(self.chars):
+            self.current_char = None
+        else:
+            self.current_char = self.chars[position]
+
+    # Table lookup used by mode="fast": maps a lexeme to its token, caching identifiers and
+    # numbers so repeated lexemes share one tuple. Returns None for irregular lexemes
+    # (malformed numbers, a lone '!', illegal characters) that token() has to handle.
+    # Lexemes are bytes for buffer input; int() and float() take those as they are and
+    # identifiers are decoded, so tokens always hold str values.
+    def fast_lookup(self):
+        cache = dict(FIXED_TOKENS if self.text else FIXED_BYTE_TOKENS)
+        get = cache.get
+        dot = '.' if self.text else b'.'
+
+        def classify(text):
+            first = text[:1]
+            if first.isalpha():
+                token = ('IDENTIFIER', sys.intern(text if self.text else text.decode('ascii')))
+            elif first.isdigit() or first == dot:
+                dots = text.count(dot)
+                if dots == 0:
+                    token = ('NUMBER', int(text))
+                elif dots == 1 and first != dot and text[-1:] != dot:
+                    token = ('FNUMBER', float(text))
+                else:
+                    return None
+            else:
+                return None
+            cache[text] = token
+            return token
+
+        return lambda text: get(text) or classify(text)
+
+    # Regex-driven scanner used by mode="fast". Yields exactly the tokens of token(),
+    # slicing lexemes out of the code instead of building them one character at a time.
+    def fast_tokens(self):
+        # Non-ASCII text keeps the reference semantics (unicode isalpha/isspace/isdigit)
+        if self.text and not self.code.isascii():
+            yield from self.reference_tokens()
+            return
+
+        lookup = self.fast_lookup()
+        search = (FAST_LEXEME if self.text else FAST_LEXEME_BYTES).search
+        positions = self.positions
+        position = self.position
         while True:
+            found = search(self.code, position)
+            if found is None:
+                break
+            token = lookup(found.group())
+            if token is None:
+                # Irregular input: the reference scanner yields the token or raises the error
+                self.seek(found.start())
+                token = self.token()
+                if token[0] == 'EOF':
+                    break
+                position = self.position
+            else:
+                position = found.end()
+            if positions:
+                self.starts.append(found.start())
+                self.ends.append(position)
+            yield token
+
+        self.seek(len(self.chars))
+        if positions:
+            self.starts.append(self.position)
+            self.ends.append(self.position)
+        yield ('EOF', None)
+
+    # Generate tokens with token(), ending with the EOF token
+    def reference_tokens(self):
+        if not self.positions:
+            while True:
+                token = self.token()
+                yield token
+                if token[0] == 'EOF':
+                    return
+
+        while True:
+            self.skip_whitespace()
+            start = self.position
             token = self.token()
-            self.tokens.append(token)
+            # EOF is an empty span at the end, even after a trailing '!' and newline
+            self.starts.append(start if token[0] != 'EOF' else self.position)
+            self.ends.append(self.position)
+            yield token
             if token[0] == 'EOF':
-                break
+                return
+
+    # Generator of the tokens from `position` on, ending with the EOF token. Like tokenize(),
+    # every call starts over with new position arrays, leaving earlier results alone; they
+    # are in place when this returns, so Parser(lexer.iter_tokens(), positions=(lexer.starts,
+    # lexer.ends)) gets the ones the generator fills. Tokens are not stored on the lexer, so
+    # a Parser fed from the generator keeps only its lookahead in memory.
+    def iter_tokens(self, position=0):
+        self.restart(position)
+        return self.fast_tokens() if self.mode == 'fast' else self.reference_tokens()
+
+    # Collect all the tokens in a list. Every call lexes the whole code again into a new
+    # list, so a lexer can tokenize any number of times.
+    def tokenize(self):
+        self.restart()
+        if self.mode == 'fast':
+            tokens = None
+            if not self.text or self.code.isascii():
+                # Bulk path: one findall over the code and a table lookup per lexeme
+                lookup = self.fast_lookup()
+                pattern = FAST_LEXEME if self.text else FAST_LEXEME_BYTES
+                lexemes = pattern.findall(self.code, self.position)
+                tokens = [lookup(text) for text in lexemes]
+            if tokens is None or None in tokens:
+                # Rescan token by token so irregular input is handled exactly like token() does
+                tokens = list(self.fast_tokens())
+            else:
+                if self.positions:
+                    self.record_positions(lexemes)
+                self.seek(len(self.chars))
+                tokens.append(('EOF', None))
+            self.tokens = tokens
+            return tokens
+
+        self.tokens = list(self.iter_tokens())
         return self.tokens
 
+    # Offsets for the bulk fast path, which only has the lexemes and the EOF token. The gaps
+    # between lexemes come from splitting the code on the same pattern, and gap plus lexeme
+    # lengths add up to the end offsets.
+    def record_positions(self, lexemes):
+        lengths = list(map(len, lexemes))
+        if self.text:
+            gaps = FAST_LEXEME.split(self.code[self.position:])
+        else:
+            with memoryview(self.code) as view:
+                gaps = FAST_LEXEME_BYTES.split(view[self.position:])
+        ends = array('q', itertools.accumulate(map(operator.add, map(len, gaps), lengths),
+                                               initial=self.position))
+        del ends[0]
+        self.ends.extend(ends)
+        self.starts.extend(map(operator.sub, ends, lengths))
+        self.starts.append(len(self.chars))
+        self.ends.append(len(self.chars))
+
+
+# Offset -> (line, column) lookups for one piece of code: a str, or a bytes-like buffer or
+# mmap.mmap as the lexer takes it, where offsets and columns count bytes. The start offset
+# of every line is found once, by one regex scan, so each lookup is a binary search.
+class LineIndex:
+    NEWLINE = re.compile('\n')
+    NEWLINE_BYTES = re.compile(b'\n')
+
+    def __init__(self, code):
+        newline = self.NEWLINE if isinstance(code, str) else self.NEWLINE_BYTES
+        self.line_starts = array('q', [0])
+        self.line_starts.extend(match.end() for match in newline.finditer(code))
+
+    # 1-based (line, column) of an offset
+    def location(self, offset):
+        line = bisect.bisect_right(self.line_starts, offset) - 1
+        return line + 1, offset - self.line_starts[line] + 1
+
 
 # Looks good above!
 
 
-class Parser:
-    def __init__(self, tokens):
+# Read-only cursor over a token list. Advancing moves an index instead of
+# shifting the list, so the caller's list is never mutated.
+class TokenStream:
+    def __init__(self, tokens, position=0):
         self.tokens = tokens
-        self.current_token = tokens.pop(0)
-        # Use these to track the variables and their scope
-        self.symbol_table = {'global': {}}
-        self.scope_counter = 0
-        self.scope_stack = ['global']
-        self.messages = []
+        self.position = position
 
-    def error(self, message):
-        self.messages.append(message)
+    # True while there are tokens left to consume.
+    def __bool__(self):
+        return self.position < len(self.tokens)
 
-    def advance(self):
-        if self.tokens:
-            self.current_token = self.tokens.pop(0)
+    # Return the next token and move the cursor past it.
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    # Like next(), but returns `default` instead of failing at the end of the stream.
+    def next_or(self, default):
+        position = self.position
+        if position < len(self.tokens):
+            self.position = position + 1
+            return self.tokens[position]
+        return default
+
+    # Look k tokens past the cursor without consuming anything.
+    def peek(self, k=0):
+        index = self.position + k
+        if index < len(self.tokens):
+            return self.tokens[index]
+        return None
+
+
+# Cursor over any token iterator, such as Lexer.iter_tokens(). Tokens are pulled on
+# demand and only the ones needed for lookahead are buffered.
+class LazyTokenStream:
+    def __init__(self, tokens):
+        self.source = iter(tokens)
+        self.buffer = collections.deque()
+        self.position = 0
+
+    # Pull tokens from the source until `count` are buffered; False if it runs dry first.
+    def fill(self, count):
+        while len(self.buffer) < count:
+            token = next(self.source, None)
+            if token is None:
+                return False
+            self.buffer.append(token)
+        return True
+
+    def __bool__(self):
+        return self.fill(1)
+
+    def next(self):
+        if not self.fill(1):
+            raise IndexError("token stream is exhausted")
+        self.position += 1
+        return self.buffer.popleft()
+
+    def next_or(self, default):
+        if self.buffer or self.fill(1):
+            self.position += 1
+            return self.buffer.popleft()
+        return default
+
+    def peek(self, k=0):
+        if self.fill(k + 1):
+            return self.buffer[k]
+        return None
+
+
+# Scoped symbol table with constant-time lookup at any nesting depth. Every name maps to
+# a stack of (type, depth) bindings, innermost last, and each scope's dict doubles as the
+# undo list of bindings to pop when that scope is exited.
+class SymbolTable:
+    def __init__(self):
+        self.scopes = {'global': {}}    # scope name -> {identifier: type}
+        self.scope_stack = ['global']
+        self.bindings = {}              # identifier -> [(type, depth), ...]
+
+    def enter(self, scope):
+        self.scopes[scope] = {}
+        self.scope_stack.append(scope)
+
+    # Leave the innermost scope, dropping the bindings it introduced. Returns its name.
+    def exit(self):
+        scope = self.scope_stack.pop()
+        for name in self.scopes.pop(scope):
+            stack = self.bindings[name]
+            stack.pop()
+            if not stack:
+                del self.bindings[name]
+        return scope
+
+    def depth(self):
+        return len(self.scope_stack) - 1
+
+    def declared_in_current(self, name):
+        return name in self.scopes[self.scope_stack[-1]]
+
+    # Bind a name in the innermost scope; a second declaration in the same scope is ignored.
+    def declare(self, name, var_type):
+        scope = self.scopes[self.scope_stack[-1]]
+        if name not in scope:
+            scope[name] = var_type
+            self.bindings.setdefault(name, []).append((var_type, len(self.scope_stack) - 1))
+
+    # Innermost visible (type, depth) binding for a name, or None if it is not declared.
+    def lookup(self, name):
+        stack = self.bindings.get(name)
+        return stack[-1] if stack else None
+
+
+# Binary operators of the expression engine: token type -> binding power. Higher binds
+# tighter and every entry is left-associative, so a new arithmetic operator only needs
+# an entry here (and a token from the lexer).
+BINARY_OPERATORS = {'PLUS': 1, 'MINUS': 1, 'MULTIPLY': 2, 'DIVIDE': 2}
+
+# Operators accepted between the two sides of a boolean_expression
+COMPARISON_OPERATORS = frozenset(('EQ', 'NEQ', 'LESS', 'GREATER'))
+
+# Tokens where the parser resumes after a syntax error: statement starts, the end of a
+# block and the end of the input
+SYNC_TOKENS = frozenset(('INT', 'FLOAT', 'IF', 'WHILE', 'IDENTIFIER', 'RBRACE', 'EOF'))
+
+# Default cap on the number of messages reported for one program
+MAX_ERRORS = 100
+
+# Deepest block nesting the parser descends into; deeper blocks (a long run of unclosed
+# `if x > 1 {`, say) are reported and skipped. Blocks are parsed recursively, at four
+# frames a level and seven with a Profiler attached, so this keeps a parse within the
+# default recursion limit with a few hundred frames to spare for the caller. It is a
+# constant so that a program gets the same messages wherever it is parsed.
+MAX_NESTING = 100
+
+
+# Default node builder. Parser creates every node through self.build, so other output
+# formats (see ASTArena.ArenaBuilder) can be plugged in without touching the grammar.
+# Builder methods take the same arguments as the ASTNodeDefs constructors.
+class TreeBuilder:
+    Assignment = AST.Assignment
+    Declaration = AST.Declaration
+    BinaryOperation = AST.BinaryOperation
+    BooleanExpression = AST.BooleanExpression
+    FunctionCall = AST.FunctionCall
+    IfStatement = AST.IfStatement
+    WhileStatement = AST.WhileStatement
+    Block = AST.Block
+    Factor = AST.Factor
+
+    # Type annotation of a built expression node
+    value_type = operator.attrgetter('value_type')
+
+    # Turn the root Block into the parse() result
+    @staticmethod
+    def finish(root):
+        return root
+
+    # Start a new output for Parser.reset(); nodes are independent objects, so nothing to do
+    @staticmethod
+    def reset():
+        pass
+
+    # Source span of a built node, see SpanBuilder
+    @staticmethod
+    def get_span(node):
+        return node.span
+
+    @staticmethod
+    def set_span(node, span):
+        node.span = span
+
+
+# Builder wrapper used when the parser is given token positions. Nodes are built by the
+# wrapped builder and get a (start, end) source span: a Factor spans the token it was
+# read from, operations and blocks span their children. Statement spans are set by
+# Parser.next_statement, since they start at a keyword no child covers.
+class SpanBuilder:
+    def __init__(self, builder, parser, starts, ends):
+        self.builder = builder
+        self.parser = parser
+        self.starts = starts
+        self.ends = ends
+
+    # Everything without span handling goes straight to the wrapped builder
+    def __getattr__(self, name):
+        return getattr(self.builder, name)
+
+    # Span covering the tokens from index `first` to the last one consumed
+    def tokens_span(self, first):
+        last = max(self.parser.tokens.position - 2, first)
+        return (self.starts[first], self.ends[last])
+
+    # Span from the first to the last node that has one, None if none of them does
+    def nodes_span(self, nodes):
+        spans = [self.builder.get_span(node) for node in nodes if node is not None]
+        spans = [span for span in spans if span is not None]
+        return (spans[0][0], spans[-1][1]) if spans else None
+
+    def Factor(self, value, value_type):
+        node = self.builder.Factor(value, value_type)
+        self.builder.set_span(node, self.tokens_span(self.parser.tokens.position - 2))
+        return node
+
+    def BinaryOperation(self, left, operator, right, value_type=None):
+        node = self.builder.BinaryOperation(left, operator, right, value_type=value_type)
+        self.builder.set_span(node, self.nodes_span((left, right)))
+        return node
+
+    def BooleanExpression(self, left, operator, right):
+        node = self.builder.BooleanExpression(left, operator, right)
+        self.builder.set_span(node, self.nodes_span((left, right)))
+        return node
+
+    def Block(self, statements):
+        node = self.builder.Block(statements)
+        self.builder.set_span(node, self.nodes_span(statements))
+        return node
+
+
+# A parser error with the (start, end) span of the token it was reported at, or of the
+# expression for a type mismatch. The span is None when the parser was not given token
+# positions.
+class Diagnostic(collections.namedtuple('Diagnostic', 'message span')):
+    __slots__ = ()
+
+    # 1-based (line, column) where the span starts, from the lexer's line_index(); None
+    # without a span
+    def location(self, lines):
+        return lines.location(self.span[0]) if self.span is not None else None
+
+
+# Setting this environment variable turns tracing on for every Parser created without
+# an explicit tracer.
+TRACE_ENV_VAR = 'PARSER_TRACE'
+
+
+# Tracer used when PARSER_TRACE is set: prints one line per event.
+def print_tracer(event, **fields):
+    details = ' '.join(f"{key}={value!r}" for key, value in fields.items())
+    print(f"[parser] {event} {details}")
+
+
+# The tracer to use for a `tracer` argument: None defers to PARSER_TRACE, False is off
+def resolve_tracer(tracer):
+    if tracer is None and os.environ.get(TRACE_ENV_VAR):
+        tracer = print_tracer
+    return tracer or None
+
+
+# Scope handling and the semantic checks, shared by Parser, which runs them while it
+# parses, and SemanticAnalyzer.SemanticAnalyzer, which runs them over a finished tree.
+# Users provide error(message) and a `tracer` attribute and call init_scopes() first.
+class SemanticChecks:
+    # Start with only the global scope. symbol_table and scope_stack are views of the
+    # SymbolTable state, kept for code that inspects them directly.
+    def init_scopes(self):
+        self.symbols = SymbolTable()
+        self.symbol_table = self.symbols.scopes
+        self.scope_counter = 0
+        self.scope_stack = self.symbols.scope_stack
 
     # TODO: Implement logic to enter a new scope, add it to symbol table, and update `scope_stack`
     def enter_scope(self):
 
         new_scope = f"scope_{self.scope_counter}"
         self.scope_counter += 1
-        print(f"Entering scope: {new_scope}")
 
-        self.symbol_table[new_scope] = {}   # Entering a new scope
-        self.scope_stack.append(new_scope)  # Updating a scope_stack
+        self.symbols.enter(new_scope)   # Entering a new scope
+        if self.tracer is not None:
+            self.tracer('scope_enter', scope=new_scope, depth=self.symbols.depth())
 
     # TODO: Implement logic to exit the current scope, removing it from `scope_stack`
     def exit_scope(self):
@@ -178,10 +721,10 @@ class Parser:
         if len(self.scope_stack) == 1:
             self.error("Cannot exit global scope.")
         else:
-            # Removing scope from scope stack as we are out of it
-            remove_scope = self.scope_stack.pop()
-            # Upating the symbol table
-            del self.symbol_table[remove_scope]
+            # Removing scope from scope stack and its bindings from the symbol table
+            remove_scope = self.symbols.exit()
+            if self.tracer is not None:
+                self.tracer('scope_exit', scope=remove_scope, depth=self.symbols.depth() + 1)
 
     # Return the current scope name
     def current_scope(self):
@@ -190,10 +733,8 @@ class Parser:
     # TODO: Check if a variable is already declared in the current scope; if so, log an error
     def checkVarDeclared(self, identifier):
 
-        current_scope = self.current_scope()
-
         # Checking for an already declared variable in the current scope
-        if identifier in self.symbol_table[current_scope]:
+        if self.symbols.declared_in_current(identifier):
             self.error(
                 f"Variable {identifier} has already been declared in the current scope")
             return True
@@ -201,29 +742,31 @@ class Parser:
 
     # TODO: Check if a variable is declared in any accessible scope; if not, log an error
     def checkVarUse(self, identifier):
-
-        # Checking if the variable has been declared in any of the accessible scopes: global or any reachable scope
-        print('Symbol Table:', self.symbol_table, self.scope_stack)
-        # Needs to be reversed since we have to check for the previous scope
-        for i in range(len(self.scope_stack)-1, -1, -1):
-            scope = self.scope_stack[i]
-
-            print('Identifier: ', identifier)
-            if scope in self.symbol_table and identifier in self.symbol_table[scope]:
-                return True
-
-        # Variable hasn't been decared if not previously found in the symbol table
-        if identifier not in self.symbol_table[self.current_scope()]:
+        return self.resolve_variable(identifier) is not None
+
+    # Look a variable up once, returning its (type, depth) binding. Logs an error and
+    # returns None if it is not declared in the current or any enclosing scope.
+    def resolve_variable(self, identifier):
+        binding = self.symbols.lookup(identifier)
+        if self.tracer is not None:
+            depth = binding[1] if binding else None
+            self.tracer('lookup', name=identifier,
+                        scope=self.scope_stack[depth] if binding else None, depth=depth)
+
+        # Variable hasn't been decared if not found in the symbol table
+        if binding is None:
             self.error(
                 f"Variable {identifier} has not been declared in the current or any enclosing scopes")
-        return False
+        return binding
 
     # TODO: Check type mismatch between two entities; log an error if they do not match
     def checkTypeMatch2(self, vType, eType, var, exp):
 
         # The project only requires us to check for 'int' and 'float' mistmatches
         if (vType == 'int' and eType == 'float') or (vType == 'float' and eType == 'int'):
-            self.error(f"Type Mismatch between {vType} and {eType}")
+            # Point at what was checked: both operands, or the value given to a variable
+            nodes = (exp,) if isinstance(var, str) else (var, exp)
+            self.error(f"Type Mismatch between {vType} and {eType}", self.nodes_span(nodes))
             return False
 
         return True
@@ -231,31 +774,144 @@ class Parser:
     # TODO: Implement logic to add a variable to the current scope in `symbol_table`
     def add_variable(self, name, var_type):
 
-        current_scope = self.current_scope()
-
-        # If not previously added in the symbol table, then add the variable
-        if name not in self.symbol_table[current_scope]:
-            self.symbol_table[current_scope][name] = var_type
+        # If not previously added in the current scope, then add the variable
+        self.symbols.declare(name, var_type)
 
     # TODO: Retrieve the variable type from `symbol_table` if it exists
     def get_variable_type(self, name):
 
         # Getting the variable type from the symbol table
-        for i in range(len(self.scope_stack) - 1, -1, -1):
-            scope = self.scope_stack[i]
-            if name in self.symbol_table[scope]:
-                return self.symbol_table[scope][name]
+        binding = self.symbols.lookup(name)
+        return binding[0] if binding else None
+
+
+class Parser(SemanticChecks):
+    # `tracer` is called as tracer(event, **fields) for scope_enter, scope_exit, lookup and
+    # assign events. None defers to the PARSER_TRACE environment variable, False turns
+    # tracing off regardless. When off, the only cost is an `is not None` check per event.
+    # `builder` decides what the parse produces; the default builds ASTNodeDefs objects.
+    # `positions` is an optional (starts, ends) pair of offset sequences parallel to the
+    # tokens, such as (lexer.starts, lexer.ends) from Lexer(code, positions=True). With it,
+    # nodes get source spans and diagnostics point at the offending token.
+    # After `max_errors` messages the parse stops as if the input had ended, with one last
+    # message saying so; None disables the cap.
+    # `profiler` is an optional Profiling.Profiler; it instruments this instance only, so
+    # parsers without one run the plain methods.
+    #
+    # reset() starts the parser over on new tokens, so one parser can serve any number of
+    # inputs, e.g. one per thread in a pool. Instances are not safe to share between
+    # threads at once.
+    def __init__(self, tokens, tracer=None, builder=None, positions=None, max_errors=MAX_ERRORS,
+                 profiler=None):
+        self.max_errors = max_errors
+        self.tracer = resolve_tracer(tracer)
+        self.builder = builder if builder is not None else TreeBuilder()
+        self.profiler = None
+        self.begin(tokens, positions)
+        if profiler is not None:
+            self.profiler = profiler
+            profiler.attach_parser(self)
+
+    # Parse new tokens (and their positions, if any) from the start. The tracer, error cap
+    # and profiler stay; the builder starts a new output, leaving earlier results alone.
+    def reset(self, tokens, positions=None):
+        self.builder.reset()
+        self.begin(tokens, positions)
+
+    # Per-parse state
+    def begin(self, tokens, positions):
+        # Accept a token list (as returned by Lexer.tokenize), any token iterator
+        # (such as Lexer.iter_tokens()) or a ready-made stream
+        if isinstance(tokens, (list, tuple)):
+            tokens = TokenStream(tokens)
+        elif not isinstance(tokens, (TokenStream, LazyTokenStream)):
+            tokens = LazyTokenStream(tokens)
+        self.tokens = tokens
+        self.current_token = tokens.next()
+        # Use these to track the variables and their scope
+        self.init_scopes()
+        self.messages = []
+        self.diagnostics = []       # one Diagnostic per entry of self.messages
+        self.panic = False          # set by a syntax error until the parser resynchronizes
+        self.syntax_errors = 0      # syntax errors reported
+        self.build = self.builder
+        self.positions = positions
+        if positions is not None:
+            self.build = SpanBuilder(self.build, self, *positions)
+        if self.profiler is not None:
+            self.profiler.attach_state(self)
+
+    # Report a message at `span`, by default the current token's
+    def error(self, message, span=None):
+        if self.max_errors is not None and len(self.messages) >= self.max_errors:
+            return
+        self.messages.append(message)
+        self.diagnostics.append(Diagnostic(message, span or self.current_span()))
+        if self.max_errors is not None and len(self.messages) == self.max_errors:
+            message = f"Too many errors, stopping after {self.max_errors}"
+            self.messages.append(message)
+            self.diagnostics.append(Diagnostic(message, self.current_span()))
+            self.stop()
+
+    # Report a syntax error and enter panic mode. Further syntax errors are dropped until
+    # the parser synchronizes, since they are usually fallout from the first one.
+    def syntax_error(self, message):
+        if not self.panic:
+            self.panic = True
+            self.syntax_errors += 1
+            self.error(message)
+
+    # Skip to the next token where parsing can resume and leave panic mode
+    def synchronize(self):
+        while self.current_token[0] not in SYNC_TOKENS:
+            self.advance()
+        self.panic = False
 
-        return None
+    # End the parse early: from here on the parser only sees EOF, so every rule in
+    # progress finishes with what it has. The stream keeps its position for spans.
+    def stop(self):
+        self.tokens = TokenStream([], self.tokens.position)
+        self.current_token = ('EOF', None)
+
+    # Source span of the current token, or None without token positions
+    def current_span(self):
+        if self.positions is None:
+            return None
+        index = self.tokens.position - 1
+        starts, ends = self.positions
+        return (starts[index], ends[index])
+
+    # Source span covering built nodes, or None without token positions
+    def nodes_span(self, nodes):
+        return self.build.nodes_span(nodes) if self.positions is not None else None
+
+    # Move to the next token; the last token (EOF) stays current at the end of the stream
+    def advance(self):
+        self.current_token = self.tokens.next_or(self.current_token)
 
     def parse(self):
-        return self.program()
+        return self.build.finish(self.program())
 
     def program(self):
         statements = []
         while self.current_token[0] != 'EOF':
-            statements.append(self.statement())
-        return AST.Block(statements)
+            statements.append(self.next_statement())
+        return self.build.Block(statements)
+
+    # Parse one statement of a program or block and recover from any syntax error in it.
+    # Every call consumes at least one token (or reaches EOF), so a parse takes time
+    # linear in the number of tokens whatever the input.
+    def next_statement(self):
+        start = self.tokens.position
+        node = self.statement()
+        if self.positions is not None and node is not None:
+            self.build.set_span(node, self.build.tokens_span(start - 1))
+        if self.panic:
+            self.synchronize()
+        if self.tokens.position == start:
+            # Nothing was consumed: the token cannot start a statement here, skip it
+            self.advance()
+        return node
 
     # TODO: Modify the `statement` function to dispatch to declare statement
     def statement(self):
@@ -269,7 +925,7 @@ class Parser:
             elif self.peek() == 'LPAREN':
                 return self.function_call()
             else:
-                self.error(
+                self.syntax_error(
                     f"Unexpected token after identifier: {self.current_token}")
 
         # Handles cases for if and while statements
@@ -278,7 +934,7 @@ class Parser:
         elif self.current_token[0] == 'WHILE':
             return self.while_stmt()
         else:
-            self.error(f"Unexpected token: {self.current_token}")
+            self.syntax_error(f"Unexpected token: {self.current_token}")
 
     # TODO: Implement the declaration statement and handle adding the variable to the symbol table
     def decl_stmt(self):
@@ -295,7 +951,7 @@ class Parser:
 
         # Declaration statement starts with an identifier = expression
         if self.current_token[0] != 'IDENTIFIER':
-            self.error(f"Expected an identifier, got {self.current_token}")
+            self.syntax_error(f"Expected an identifier, got {self.current_token}")
             return None
 
         var_name = self.current_token[1]
@@ -310,7 +966,7 @@ class Parser:
             self.advance()
             # Moving to expression
             expression = self.expression()
-            expr_type = expression.value_type
+            expr_type = self.build.value_type(expression)
 
             # Checking for type mismatch between identifier and expression
             self.checkTypeMatch2(var_type, expr_type, var_name, expression)
@@ -318,7 +974,7 @@ class Parser:
         # Adding variable to symbol table to the symbol table
         self.add_variable(var_name, var_type)
 
-        return AST.Declaration(var_type, var_name, expression)
+        return self.build.Declaration(var_type, var_name, expression)
 
     # TODO: Parse assignment statements, handle type checking
     def assign_stmt(self):
@@ -331,29 +987,31 @@ class Parser:
         """
 
         if self.current_token[0] != 'IDENTIFIER':
-            self.error(
+            self.syntax_error(
                 f"Expected an identifier for assignment, got {self.current_token}")
         var_name = self.current_token[1]
 
         # Checking if the variable has been declared in any of the accessible scopes
-        self.checkVarUse(var_name)
+        binding = self.resolve_variable(var_name)
         self.advance()
 
         # Getting equals
         if self.current_token[0] != 'EQUALS':
-            self.error(f"Expected '=', got {self.current_token}")
+            self.syntax_error(f"Expected '=', got {self.current_token}")
         self.advance()
 
         # Getting expression
         expression = self.expression()
 
         # Checking for type mismatches in the expression
-        var_type = self.get_variable_type(var_name)
-        print(var_type, expression.value_type)
+        var_type = binding[0] if binding else None
+        if self.tracer is not None:
+            self.tracer('assign', name=var_name, var_type=var_type,
+                        value_type=self.build.value_type(expression))
         self.checkTypeMatch2(
-            var_type, expression.value_type, var_name, expression)
+            var_type, self.build.value_type(expression), var_name, expression)
 
-        return AST.Assignment(var_name, expression)
+        return self.build.Assignment(var_name, expression)
 
     # TODO: Implement the logic to parse the if condition and blocks of code
     def if_stmt(self):
@@ -371,7 +1029,7 @@ class Parser:
 
         # If condition {}   else{}
         if self.current_token[0] != 'IF':
-            self.error(f"Expected 'IF', got {self.current_token}")
+            self.syntax_error(f"Expected 'IF', got {self.current_token}")
         self.advance()
 
         # Condition expected after 'if'
@@ -379,13 +1037,13 @@ class Parser:
 
         # Curly Braces expected after the condition statememt
         if self.current_token[0] != 'LBRACE':
-            self.error(f"Expected '{{', got {self.current_token}")
+            self.syntax_error(f"Expected '{{', got {self.current_token}")
         self.advance()
         self.enter_scope()
         then_block = self.block()
 
         if self.current_token[0] != 'RBRACE':
-            self.error(f"Expected '}}', got {self.current_token}")
+            self.syntax_error(f"Expected '}}', got {self.current_token}")
         self.advance()
         self.exit_scope()
 
@@ -396,17 +1054,17 @@ class Parser:
             self.advance()
 
             if self.current_token[0] != 'LBRACE':
-                self.error(f"Expected '{{', got {self.current_token}")
+                self.syntax_error(f"Expected '{{', got {self.current_token}")
             self.advance()
             self.enter_scope()
             else_block = self.block()
 
             if self.current_token[0] != 'RBRACE':
-                self.error(f"Expected '}}', got {self.current_token}")
+                self.syntax_error(f"Expected '}}', got {self.current_token}")
                 return None
             self.advance()
             self.exit_scope()
-        return AST.IfStatement(condition, then_block, else_block)
+        return self.build.IfStatement(condition, then_block, else_block)
 
     # TODO: Implement the logic to parse while loops with a condition and a block of statements
     def while_stmt(self):
@@ -420,23 +1078,23 @@ class Parser:
         """
 
         if self.current_token[0] != 'WHILE':
-            self.error(f"Expected 'WHILE', got {self.current_token}")
+            self.syntax_error(f"Expected 'WHILE', got {self.current_token}")
         self.advance()
 
         condition = self.boolean_expression()
 
         if self.current_token[0] != 'LBRACE':
-            self.error(f"Expected '{{', got {self.current_token}")
+            self.syntax_error(f"Expected '{{', got {self.current_token}")
         self.advance()
         self.enter_scope()
         block = self.block()
 
         if self.current_token[0] != 'RBRACE':
-            self.error(f"Expected '}}', got {self.current_token}")
+            self.syntax_error(f"Expected '}}', got {self.current_token}")
         self.advance()
         self.exit_scope()
 
-        return AST.WhileStatement(condition, block)
+        return self.build.WhileStatement(condition, block)
 
     # TODO: Implement logic to capture multiple statements as part of a block
     def block(self):
@@ -450,35 +1108,97 @@ class Parser:
         TODO: Implement logic to capture multiple statements as part of a block.
         """
 
+        if self.symbols.depth() > MAX_NESTING:
+            self.syntax_error(f"Blocks nested deeper than {MAX_NESTING} levels")
+            self.skip_block()
+            return self.build.Block([])
+
+        # Resume after a syntax error in the statement header before the block
+        if self.panic:
+            self.synchronize()
+
         # Storing the statements in an array
         statements = []
         while self.current_token[0] != 'RBRACE' and self.current_token[0] != 'EOF':
-            statements.append(self.statement())
+            statements.append(self.next_statement())
 
-        return AST.Block(statements)
+        return self.build.Block(statements)
+
+    # Skip the rest of the current block, stopping at its closing '}' or at EOF
+    def skip_block(self):
+        depth = 0
+        while self.current_token[0] != 'EOF':
+            if self.current_token[0] == 'LBRACE':
+                depth += 1
+            elif self.current_token[0] == 'RBRACE':
+                if depth == 0:
+                    return
+                depth -= 1
+            self.advance()
 
     # TODO: Implement logic to parse binary operations (e.g., addition, subtraction) with correct precedence and type checking
-    def expression(self):
+    def expression(self, min_power=1):
         """
         Parses an expression. Handles operators like +, -, etc.
         Example:
         x + y - 5
-        TODO: Implement logic to parse binary operations (e.g., addition, subtraction) with correct precedence and type checking.
+
+        Operators and their precedence come from BINARY_OPERATORS. Precedence climbing runs
+        on explicit operand/operator stacks, parentheses included, so neither long operator
+        chains nor deeply nested parentheses grow the Python stack. Nodes are built and
+        type-checked in the same order as a recursive expression/term/factor descent.
+        Operators binding looser than `min_power` end the expression (outside parentheses).
         """
-        left = self.term()      # Left Term
-        while self.current_token[0] in ['PLUS', 'MINUS']:
-            operator = self.current_token[0]
+        build = self.build
+        value_type = build.value_type
+        powers = BINARY_OPERATORS
+        operands = []
+        # Operators awaiting a right operand, as parallel power/operator stacks. Power 0
+        # marks an open '(' and the -1 at the bottom saves an emptiness check.
+        pending_powers = [-1]
+        pending_operators = [None]
+        open_parens = 0
+        while True:
+            # Operand position: any number of '(' followed by a factor
+            while self.current_token[0] == 'LPAREN':
+                self.advance()
+                pending_powers.append(0)
+                pending_operators.append(None)
+                open_parens += 1
+            operands.append(self.factor())
+
+            # Operator position. Anything that is not an operator allowed here closes the
+            # innermost parenthesis or ends the expression, after reducing down to it.
+            while True:
+                operator = self.current_token[0]
+                power = powers.get(operator)
+                if power is not None and power < min_power and not open_parens:
+                    power = None
+
+                # Left-associative: finish pending operators that bind at least as tightly
+                while pending_powers[-1] >= (power or 1):
+                    pending_powers.pop()
+                    right = operands.pop()
+                    left = operands[-1]
+                    left_type = value_type(left)
+                    right_type = value_type(right)
+                    if left_type != right_type:
+                        self.checkTypeMatch2(left_type, right_type, left, right)
+                    operands[-1] = build.BinaryOperation(
+                        left, pending_operators.pop(), right, value_type=left_type)
+
+                if power is not None:
+                    break
+                if not open_parens:
+                    return operands[0]
+                self.expect('RPAREN')
+                pending_powers.pop()
+                pending_operators.pop()
+                open_parens -= 1
+
+            pending_powers.append(power)
+            pending_operators.append(operator)
             self.advance()
-            right = self.term()   # Right term
-
-            # Checking for type mismatch
-            self.checkTypeMatch2(
-                left.value_type, right.value_type, left, right)
-
-            left = AST.BinaryOperation(
-                left, operator, right, value_type=left.value_type)
-
-        return left
 
     # TODO: Implement parsing for boolean expressions and check for type compatibility
     def boolean_expression(self):
@@ -492,17 +1212,17 @@ class Parser:
         left = self.expression()  # Left term
 
         # Boolean operator expected
-        if (self.current_token[0] != 'EQ') and (self.current_token[0] != 'NEQ') and (self.current_token[0] != 'LESS') and (self.current_token[0] != 'GREATER'):
-            self.error(
+        if self.current_token[0] not in COMPARISON_OPERATORS:
+            self.syntax_error(
                 f"Expected a boolean operator, got {self.current_token}")
 
         operator = self.current_token[0]
         self.advance()
         right = self.expression()  # Right term
 
-        self.checkTypeMatch2(left.value_type, right.value_type, left, right)
+        self.checkTypeMatch2(self.build.value_type(left), self.build.value_type(right), left, right)
 
-        return AST.BooleanExpression(left, operator, right)
+        return self.build.BooleanExpression(left, operator, right)
 
     # TODO: Implement parsing for multiplication and division and check for type compatibility
     def term(self):
@@ -510,44 +1230,29 @@ class Parser:
         Parses a term. A term consists of factors combined by * or /.
         Example:
         x * y / z
-        TODO: Implement parsing for multiplication and division and check for type compatibility.
         """
-
-        # Checking type compatibility for multiplication and division products
-
-        left = self.factor()  # Left term
-
-        while self.current_token[0] in ['MULTIPLY', 'DIVIDE']:
-            op = self.current_token[0]
-            self.advance()
-            right = self.factor()   # Right term
-            self.checkTypeMatch2(
-                left.value_type, right.value_type, left, right)
-
-            left = AST.BinaryOperation(
-                left, op, right, value_type=left.value_type)
-        return left
+        return self.expression(BINARY_OPERATORS['MULTIPLY'])
 
     def factor(self):
         if self.current_token[0] == 'NUMBER':
             # handle int
             num = self.current_token[1]
             self.advance()
-            return AST.Factor(num, 'int')
+            return self.build.Factor(num, 'int')
         elif self.current_token[0] == 'FNUMBER':
             # handle float
             num = self.current_token[1]
             self.advance()
-            return AST.Factor(num, 'float')
+            return self.build.Factor(num, 'float')
         elif self.current_token[0] == 'IDENTIFIER':
             # TODO: Ensure that you parse the identifier correctly, retrieve its type from the symbol table, and check if it has been declared in the current or any enclosing scopes.
             var_name = self.current_token[1]
-            # Checking if the variable has been declared in any of the accessible scopes
-            self.checkVarUse(var_name)
-
-            var_type = self.get_variable_type(var_name)
+            # Checking if the variable has been declared in any of the accessible scopes,
+            # fetching its type with the same lookup
+            binding = self.resolve_variable(var_name)
+            var_type = binding[0] if binding else None
             self.advance()
-            return AST.Factor(var_name, var_type)
+            return self.build.Factor(var_name, var_type)
 
         # Parsing identifier correctly
         elif self.current_token[0] == 'LPAREN':
@@ -556,8 +1261,11 @@ class Parser:
             self.expect('RPAREN')
             return expr
         else:
-            self.error(
+            # Leave the token for the caller to recover at; the placeholder keeps the
+            # expression well formed
+            self.syntax_error(
                 f"Unexpected token in factor: {self.current_token}")
+            return self.build.Factor(None, None)
 
     # These function had already been implemented for us
 
@@ -568,7 +1276,7 @@ class Parser:
         args = self.arg_list()
         self.expect('RPAREN')
 
-        return AST.FunctionCall(func_name, args)
+        return self.build.FunctionCall(func_name, args)
 
     def arg_list(self):
         """
@@ -585,12 +1293,38 @@ class Parser:
 
         return args
 
+    # Consume a token of the given type, or report a syntax error and leave the token
     def expect(self, token_type):
         if self.current_token[0] == token_type:
             self.advance()
-        else:
-            raise ValueError(
-                f"Expected token {token_type}, but got {self.current_token[0]}")
+            return True
+        self.syntax_error(
+            f"Expected token {token_type}, but got {self.current_token[0]}")
+        return False
+
+    # Type of the token k positions after the current one, or None past the end
+    def peek(self, k=1):
+        token = self.tokens.peek(k - 1)
+        return token[0] if token else None
+
+
+class SyntaxParser(Parser):
+    """
+    Parser that only checks syntax. Declarations, lookups and type checks are skipped,
+    so messages are syntax errors only and identifier factors (and the operations they
+    start) are left without a value_type. Running SemanticAnalyzer over the tree fills
+    those in and reports the semantic messages Parser would have reported.
+    Scopes are still entered and left, to keep the nesting limit.
+    """
+
+    def checkVarDeclared(self, identifier):
+        return False
+
+    def resolve_variable(self, identifier):
+        return None
 
-    def peek(self):
-        return self.tokens[0][0] if self.tokens else None
+    def checkTypeMatch2(self, vType, eType, var, exp):
+        return True
+
+    def add_variable(self, name, var_type):
+        pass
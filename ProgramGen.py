@@ -0,0 +1,151 @@
+"""
+Seeded generator of programs for benchmarks.
+
+    code = generate_program(statements=10_000, seed=1, depth=3)
+
+Programs follow grammar.txt and are semantically clean: every variable is declared
+before use, types match, and no name is declared twice in one scope, so parsing one
+exercises the happy path with no messages. The same arguments always give the same
+program.
+
+Knobs:
+    statements          number of top-level statements (plus one counter declaration
+                        in front of each top-level while loop)
+    depth               deepest nesting of if/while blocks
+    identifiers         number of global variables (declared as the program goes)
+    expression_length   most operands in one arithmetic expression
+
+While loops count a fresh counter up to a small bound and never assign it in their body,
+so generated programs also terminate when executed.
+"""
+import random
+
+BINARY = ('+', '-', '*', '/')
+COMPARISONS = ('==', '!=', '<', '>')
+FUNCTIONS = ('print', 'log', 'emit')
+
+
+class ProgramGenerator:
+    def __init__(self, seed=0, depth=2, identifiers=50, expression_length=4):
+        self.rng = random.Random(seed)
+        self.depth = depth
+        self.identifiers = identifiers
+        self.expression_length = max(1, expression_length)
+        # Variables visible in each open scope, innermost last: {'int': [...], 'float': [...]}
+        self.scopes = [{'int': [], 'float': []}]
+        self.declared = 0       # globals declared so far
+        self.locals = 0         # block-local names handed out, to keep them unique
+        self.lines = []
+
+    def visible(self, var_type):
+        return [name for scope in self.scopes for name in scope[var_type]]
+
+    def literal(self, var_type, nonzero=False):
+        value = self.rng.randrange(1 if nonzero else 0, 100)
+        return f"{value}.5" if var_type == 'float' else str(value)
+
+    def operand(self, var_type):
+        names = self.visible(var_type)
+        if names and self.rng.random() < 0.6:
+            return self.rng.choice(names)
+        return self.literal(var_type)
+
+    # Arithmetic expression of one type, with the occasional parenthesized group.
+    # Division is only ever by a non-zero literal.
+    def expression(self, var_type, length=None):
+        rng = self.rng
+        length = rng.randint(1, self.expression_length) if length is None else length
+        parts = []
+        remaining = length
+        while remaining:
+            if parts:
+                parts.append(rng.choice(BINARY))
+            if parts and parts[-1] == '/':
+                parts.append(self.literal(var_type, nonzero=True))
+                remaining -= 1
+            elif remaining > 2 and rng.random() < 0.15:
+                size = rng.randint(2, remaining - 1)
+                parts.append(f"({self.expression(var_type, size)})")
+                remaining -= size
+            else:
+                parts.append(self.operand(var_type))
+                remaining -= 1
+        return ' '.join(parts)
+
+    def condition(self):
+        var_type = self.rng.choice(('int', 'float'))
+        return f"{self.expression(var_type)} {self.rng.choice(COMPARISONS)} {self.expression(var_type)}"
+
+    def local_name(self, prefix):
+        self.locals += 1
+        return f"{prefix}{self.locals}"
+
+    def declaration(self, indent, level):
+        var_type = self.rng.choice(('int', 'float'))
+        if level:
+            name = self.local_name('t')
+        else:
+            name = f"{var_type[0]}{self.declared}"
+            self.declared += 1
+        self.lines.append(f"{indent}{var_type} {name} = {self.expression(var_type)}")
+        self.scopes[-1][var_type].append(name)
+
+    def assignment(self, indent):
+        var_type = self.rng.choice([var_type for var_type in ('int', 'float') if self.visible(var_type)])
+        name = self.rng.choice(self.visible(var_type))
+        self.lines.append(f"{indent}{name} = {self.expression(var_type)}")
+
+    def function_call(self, indent):
+        arguments = ', '.join(self.expression(self.rng.choice(('int', 'float')))
+                              for _ in range(self.rng.randint(0, 3)))
+        self.lines.append(f"{indent}{self.rng.choice(FUNCTIONS)}({arguments})")
+
+    def if_stmt(self, indent, level):
+        self.lines.append(f"{indent}if {self.condition()} {{")
+        self.block(level + 1)
+        if self.rng.random() < 0.5:
+            self.lines.append(f"{indent}}} else {{")
+            self.block(level + 1)
+        self.lines.append(f"{indent}}}")
+
+    # A counted loop: the counter is declared just before it and only the loop updates it
+    def while_stmt(self, indent, level):
+        counter = self.local_name('w')
+        self.lines.append(f"{indent}int {counter} = 0")
+        self.lines.append(f"{indent}while {counter} < {self.rng.randint(1, 10)} {{")
+        self.block(level + 1)
+        self.lines.append(f"{indent}    {counter} = {counter} + 1")
+        self.lines.append(f"{indent}}}")
+
+    def block(self, level):
+        self.scopes.append({'int': [], 'float': []})
+        for _ in range(self.rng.randint(1, 4)):
+            self.statement(level)
+        self.scopes.pop()
+
+    def statement(self, level):
+        indent = '    ' * level
+        kind = self.rng.random()
+        if kind >= 0.82 and level < self.depth:
+            if kind < 0.92:
+                self.if_stmt(indent, level)
+            else:
+                self.while_stmt(indent, level)
+        elif kind >= 0.75:
+            self.function_call(indent)
+        elif (kind < 0.3 and (level or self.declared < self.identifiers)) or \
+                not (self.visible('int') or self.visible('float')):
+            self.declaration(indent, level)
+        else:
+            self.assignment(indent)
+
+    def program(self, statements):
+        for _ in range(statements):
+            self.statement(0)
+        return '\n'.join(self.lines) + '\n'
+
+
+def generate_program(statements=1000, seed=0, depth=2, identifiers=50, expression_length=4):
+    """Return the source of a generated program, see the module docstring for the knobs."""
+    generator = ProgramGenerator(seed, depth, identifiers, expression_length)
+    return generator.program(statements)
@@ -0,0 +1,168 @@
+"""
+Semantic analysis as a separate pass over a parsed tree.
+
+    parser = SyntaxParser(tokens)
+    tree = parser.parse()                       # syntax only
+    messages = parser.messages + SemanticAnalyzer().analyze(tree, len(parser.messages))
+
+The analyzer runs the parser's own checks (Parser.SemanticChecks) from an iterative
+walk, in the order the parser runs them while parsing, so for a program without syntax
+errors it reports exactly the messages Parser reports, in the same order. It also fills
+in what a syntax-only parse leaves out: the value_type of identifier factors and of the
+operations they start. Afterwards the tree equals the one Parser builds.
+
+A tree from a parse with syntax errors can be analyzed too. Parser interleaves syntax and
+semantic messages; merge_diagnostics() puts the two passes' messages back in that order
+from their spans, so parse with positions and leave the cap to the merge:
+
+    parser = SyntaxParser(tokens, positions=(lexer.starts, lexer.ends), max_errors=None)
+    tree = parser.parse()
+    analyzer = SemanticAnalyzer(max_errors=None)
+    analyzer.analyze(tree)
+    diagnostics = merge_diagnostics(parser.diagnostics, analyzer.diagnostics)
+
+The result can still differ from Parser's messages: Parser also checks partial statements
+that never make it into the tree, and runs a statement's checks only once it has read
+all of it, including tokens that error recovery left out of the tree.
+"""
+import heapq
+
+import ASTNodeDefs as AST
+import Parser as p0
+
+
+class SemanticAnalyzer(p0.SemanticChecks, AST.NodeVisitor):
+    # `tracer` works as for Parser: None defers to PARSER_TRACE, False turns it off.
+    # `max_errors` caps the messages as Parser's does, with the same last message; the
+    # walk goes on past the cap, so value types are still filled in everywhere.
+    def __init__(self, tracer=None, max_errors=p0.MAX_ERRORS):
+        self.tracer = p0.resolve_tracer(tracer)
+        self.max_errors = max_errors
+        self.reset()
+
+    # Fresh scopes and messages. analyze() starts with this, so one analyzer can check
+    # any number of trees; lists returned earlier are not touched.
+    def reset(self):
+        self.init_scopes()
+        self.messages = []
+        self.diagnostics = []   # Diagnostics carry the span of the node being checked
+        self.root = None
+        self.node = None
+        self.bindings = []      # bindings of the assignment targets being checked
+        self.reported = 0       # messages reported for the tree before this pass
+
+    def error(self, message, span=None):
+        if self.max_errors is not None and self.reported + len(self.messages) >= self.max_errors:
+            return
+        if span is None and self.node is not None:
+            span = self.node.span
+        self.messages.append(message)
+        self.diagnostics.append(p0.Diagnostic(message, span))
+        if self.max_errors is not None and self.reported + len(self.messages) == self.max_errors:
+            message = f"Too many errors, stopping after {self.max_errors}"
+            self.messages.append(message)
+            self.diagnostics.append(p0.Diagnostic(message, span))
+
+    # Span from the first to the last node that has one, as SpanBuilder.nodes_span
+    @staticmethod
+    def nodes_span(nodes):
+        spans = [node.span for node in nodes if node is not None and node.span is not None]
+        return (spans[0][0], spans[-1][1]) if spans else None
+
+    def analyze(self, tree, reported=0):
+        """
+        Check a tree, updating its value types in place, and return the messages.
+        `reported` is the number of messages an earlier pass already gave for the same
+        program, such as len(syntax_parser.messages); they count towards max_errors.
+        """
+        self.reset()
+        self.reported = reported
+        self.root = tree
+        self.traverse(tree)
+        return self.messages
+
+    # The program's own block runs in the global scope; every other block has its own
+    def visit_Block(self, node):
+        if node is not self.root:
+            self.node = node
+            self.enter_scope()
+
+    def leave_Block(self, node):
+        if node is not self.root:
+            self.node = node
+            self.exit_scope()
+
+    # Parser checks for a redeclaration before parsing the initializer and declares the
+    # variable after type-checking it
+    def visit_Declaration(self, node):
+        self.node = node
+        self.checkVarDeclared(node.identifier)
+
+    def leave_Declaration(self, node):
+        self.node = node
+        if node.expression is not None:
+            self.checkTypeMatch2(node.var_type, node.expression.value_type, node.identifier,
+                                 node.expression)
+        self.add_variable(node.identifier, node.var_type)
+
+    def visit_Assignment(self, node):
+        self.node = node
+        self.bindings.append(self.resolve_variable(node.identifier))
+
+    def leave_Assignment(self, node):
+        self.node = node
+        binding = self.bindings.pop()
+        var_type = binding[0] if binding else None
+        value_type = node.expression.value_type
+        if self.tracer is not None:
+            self.tracer('assign', name=node.identifier, var_type=var_type, value_type=value_type)
+        self.checkTypeMatch2(var_type, value_type, node.identifier, node.expression)
+
+    # Literals are typed by the parser; names get the type of their binding
+    def visit_Factor(self, node):
+        if isinstance(node.value, str):
+            self.node = node
+            binding = self.resolve_variable(node.value)
+            node.value_type = binding[0] if binding else None
+
+    # As in Parser.expression: operands of different types are checked, and an operation
+    # has the type of its left operand
+    def leave_BinaryOperation(self, node):
+        self.node = node
+        left_type = node.left.value_type
+        right_type = node.right.value_type
+        if left_type != right_type:
+            self.checkTypeMatch2(left_type, right_type, node.left, node.right)
+        node.value_type = left_type
+
+    def leave_BooleanExpression(self, node):
+        self.node = node
+        self.checkTypeMatch2(node.left.value_type, node.right.value_type, node.left, node.right)
+
+
+# Diagnostics paired with the source offset Parser reports them at. A syntax error is
+# reported on reaching its token, a semantic check once the checked node has been read.
+# Diagnostics without a span keep the offset of the one before.
+def keyed_diagnostics(diagnostics, end):
+    offset = -1
+    for diagnostic in diagnostics:
+        if diagnostic.span is not None:
+            offset = diagnostic.span[end]
+        yield offset, diagnostic
+
+
+def merge_diagnostics(syntax_diagnostics, semantic_diagnostics, max_errors=p0.MAX_ERRORS):
+    """
+    Merge the diagnostics of a SyntaxParser and of a SemanticAnalyzer over its tree into
+    the order Parser gives them, and apply Parser's error cap to the merged list. Both
+    passes should run with max_errors=None and with positions, since the order comes
+    from the spans.
+    """
+    merged = [diagnostic for _, diagnostic in heapq.merge(
+        keyed_diagnostics(semantic_diagnostics, 1), keyed_diagnostics(syntax_diagnostics, 0),
+        key=lambda keyed: keyed[0])]
+    if max_errors is not None and len(merged) >= max_errors:
+        del merged[max_errors:]
+        if merged:
+            merged.append(p0.Diagnostic(f"Too many errors, stopping after {max_errors}", merged[-1].span))
+    return merged
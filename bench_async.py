@@ -0,0 +1,101 @@
+"""
+Load test for AsyncParse.ParseService.
+
+Generates --programs distinct programs with ProgramGen and sends --requests parse
+requests from --concurrency concurrent clients, each picking a random program so that
+popular sources overlap and get deduplicated. Reports:
+
+    latency     p50, p90, p99 and max per request, from the call to the result
+    throughput  completed requests per second
+    loop lag    how late a 5 ms timer on the event loop fires while the test runs,
+                which shows whether parsing is keeping the loop from serving others
+    service     requests shared with a parse in flight, timeouts
+
+Usage: python bench_async.py [--requests N] [--concurrency C] [--programs P]
+                             [--statements S] [--executor thread|process] [--workers W]
+                             [--max-in-flight M] [--timeout T] [--seed S]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from AsyncParse import EXECUTORS, ParseService
+from ProgramGen import generate_program
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values, percent):
+    if not values:
+        return float('nan')
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+async def client(service, sources, requests, rng, latencies):
+    while requests:
+        requests.pop()
+        start = time.perf_counter()
+        try:
+            await service.parse(rng.choice(sources))
+        except TimeoutError:
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+# Largest delay of a periodic timer past its deadline until `stop` is set
+async def loop_lag(stop, interval=0.005):
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def load_test(args):
+    sources = [generate_program(args.statements, seed=args.seed + index)
+               for index in range(args.programs)]
+    rng = random.Random(args.seed)
+    requests = list(range(args.requests))
+    latencies = []
+    async with ParseService(max_workers=args.workers, max_in_flight=args.max_in_flight,
+                            timeout=args.timeout, executor=args.executor) as service:
+        stop = asyncio.Event()
+        lag = asyncio.ensure_future(loop_lag(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(client(service, sources, requests, rng, latencies)
+                               for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        return latencies, elapsed, await lag, service.stats()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--requests', type=int, default=500)
+    arg_parser.add_argument('--concurrency', type=int, default=32)
+    arg_parser.add_argument('--programs', type=int, default=100)
+    arg_parser.add_argument('--statements', type=int, default=200)
+    arg_parser.add_argument('--executor', choices=sorted(EXECUTORS), default='thread')
+    arg_parser.add_argument('--workers', type=int, default=None)
+    arg_parser.add_argument('--max-in-flight', type=int, default=None)
+    arg_parser.add_argument('--timeout', type=float, default=None)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    latencies, elapsed, lag, stats = asyncio.run(load_test(args))
+    latencies.sort()
+    print(f"{args.requests:,} requests from {args.concurrency} clients over {args.programs} "
+          f"programs of {args.statements} statements, {args.executor} pool")
+    print(f"latency     p50 {percentile(latencies, 50) * 1000:8.1f} ms  "
+          f"p90 {percentile(latencies, 90) * 1000:8.1f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:8.1f} ms  "
+          f"max {latencies[-1] * 1000 if latencies else float('nan'):8.1f} ms")
+    print(f"throughput  {len(latencies) / elapsed:,.0f} requests/s ({elapsed:.2f} s)")
+    print(f"loop lag    {lag * 1000:.1f} ms at worst")
+    print(f"service     {stats['shared']} shared, {stats['timeouts']} timed out")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Memory benchmark for the AST node classes.
+
+Parses a generated program and measures bytes per node for the slot-based
+classes in ASTNodeDefs against equivalent classes that keep a per-instance
+__dict__ (the layout the node classes had before).
+
+Usage: python bench_memory.py [--statements N] [--seed S]
+"""
+import argparse
+import time
+import tracemalloc
+
+import ASTNodeDefs as AST
+import Parser as p0
+from ProgramGen import generate_program
+
+NODE_CLASSES = [AST.Assignment, AST.Declaration, AST.BinaryOperation, AST.BooleanExpression,
+                AST.FunctionCall, AST.IfStatement, AST.WhileStatement, AST.Block, AST.Factor]
+
+
+# Same constructor and fields, but attributes live in a per-instance __dict__
+def dict_backed(cls):
+    return type(cls.__name__, (object,), {'__init__': cls.__init__})
+
+
+def clone(node, classes):
+    """Copy a tree into another family of node classes, returning (copy, node count)."""
+    if isinstance(node, list):
+        copies = [clone(item, classes) for item in node]
+        return [c for c, _ in copies], sum(n for _, n in copies)
+    if not isinstance(node, AST.ASTNode):
+        return node, 0
+    cls = type(node)
+    copy = classes[cls].__new__(classes[cls])
+    count = 1
+    for field in cls.__slots__:
+        value, n = clone(getattr(node, field), classes)
+        setattr(copy, field, value)
+        count += n
+    return copy, count
+
+
+def measure(tree, classes):
+    tracemalloc.start()
+    copy, count = clone(tree, classes)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copy
+    return size, count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--statements', type=int, default=1_000_000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    code = generate_program(args.statements, seed=args.seed)
+    start = time.perf_counter()
+    tree = p0.Parser(p0.Lexer(code, mode='fast').iter_tokens()).parse()
+    print(f"parsed {args.statements} statements in {time.perf_counter() - start:.2f}s")
+
+    before, count = measure(tree, {cls: dict_backed(cls) for cls in NODE_CLASSES})
+    after, _ = measure(tree, {cls: cls for cls in NODE_CLASSES})
+    print(f"nodes: {count}")
+    print(f"__dict__ nodes: {before / count:.1f} bytes/node ({before / 2**20:.1f} MiB)")
+    print(f"__slots__ nodes: {after / count:.1f} bytes/node ({after / 2**20:.1f} MiB)")
+    print(f"saved: {100 * (before - after) / before:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
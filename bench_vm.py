@@ -0,0 +1,62 @@
+"""
+Benchmark for the bytecode VM against the tree-walking interpreter.
+
+Generates a program with ProgramGen, parses it, and times:
+
+    compile     Compiler().compile(tree)
+    vm          VM().run(program)
+    interpret   TreeInterpreter().run(tree)
+
+Each is the best of --repeat runs. Generated programs terminate and only divide by
+non-zero literals, so every one of them runs to the end.
+
+Usage: python bench_vm.py [--statements N] [--depth D] [--seed S] [--repeat R]
+"""
+import argparse
+import gc
+import time
+
+import Parser as p0
+from BytecodeVM import Compiler, TreeInterpreter, VM
+from ProgramGen import generate_program
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--statements', type=int, default=20_000)
+    arg_parser.add_argument('--depth', type=int, default=2)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    code = generate_program(args.statements, seed=args.seed, depth=args.depth)
+    tree = p0.Parser(p0.Lexer(code, mode='fast').tokenize()).parse()
+    program = Compiler().compile(tree)
+    vm = VM()
+    interpreter = TreeInterpreter()
+    print(f"{args.statements:,} statements, {len(program.code) // 2:,} instructions, "
+          f"{program.frame_size} slots, {len(program.constants)} constants")
+
+    compile_seconds = best_time(lambda: Compiler().compile(tree), args.repeat)
+    vm_seconds = best_time(lambda: vm.run(program), args.repeat)
+    interpret_seconds = best_time(lambda: interpreter.run(tree), args.repeat)
+    print(f"compile    {compile_seconds * 1000:9.1f} ms")
+    print(f"vm         {vm_seconds * 1000:9.1f} ms")
+    print(f"interpret  {interpret_seconds * 1000:9.1f} ms")
+    print(f"vm speedup {interpret_seconds / vm_seconds:9.2f}x "
+          f"({interpret_seconds / (vm_seconds + compile_seconds):.2f}x including compile)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Benchmark suite for the lexer, parser, symbol table and AST serialization.
+
+Generates a program with ProgramGen, then times each phase on its own:
+
+    tokenize        Lexer(code).tokenize()
+    tokenize_fast   Lexer(code, mode='fast').tokenize()
+    parse           Parser(tokens).parse() on an already lexed token list
+    parse_syntax    SyntaxParser(tokens).parse(), the same parse without semantic checks
+    parse_parallel  BatchParse.parse_parallel(code), lexing and parsing in pieces across
+                    a process pool (a plain serial parse with a single CPU)
+    semantic        SemanticAnalyzer().analyze() over a syntax-only tree
+    symbols         the parse's symbol-table operations (enter/exit, declare, lookup)
+                    replayed against a fresh SymbolTable
+    optimize        Optimizer().optimize(tree), constant folding and reassociation
+    to_string       tree.to_string()
+    dump_binary     ASTBinary.dumps(tree)
+    load_binary     ASTBinary.load() of that encoding, to compare against lexing and parsing
+
+Each phase reports its best time over --repeat runs, a throughput (tokens/sec for
+lexing and parsing, also statements/sec for parsing, operations/sec for the symbol
+table, characters/sec for to_string, encoded bytes/sec for the binary format) and its
+peak traced memory, measured in a separate run under tracemalloc so tracing does not
+slow down the timed runs.
+
+Results can be saved as a JSON baseline and compared against later:
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json     # exit status 1 on a regression
+
+Usage: python benchmark.py [--statements N] [--depth D] [--identifiers I]
+                           [--expression-length E] [--seed S] [--repeat R]
+                           [--save FILE] [--compare FILE] [--threshold PCT]
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import ASTBinary
+import ASTNodeDefs as AST
+import BatchParse
+import Parser as p0
+from Optimizer import Optimizer
+from ProgramGen import generate_program
+from SemanticAnalyzer import SemanticAnalyzer
+
+
+# Symbol-table operations a parse performs, in order, recorded from the tree: a block
+# scope is entered and left around every nested block, a declaration checks the current
+# scope and then declares, and every use of a variable is one lookup.
+class SymbolOps(AST.NodeVisitor):
+    def __init__(self):
+        self.ops = []
+        self.root = None
+
+    def record(self, root):
+        self.root = root
+        self.traverse(root)
+        return self.ops
+
+    def visit_Block(self, node):
+        if node is not self.root:
+            self.ops.append(('enter', f"scope_{len(self.ops)}"))
+
+    def leave_Block(self, node):
+        if node is not self.root:
+            self.ops.append(('exit',))
+
+    def visit_Declaration(self, node):
+        self.ops.append(('declared_in_current', node.identifier))
+
+    def leave_Declaration(self, node):
+        self.ops.append(('declare', node.identifier, node.var_type))
+
+    def visit_Assignment(self, node):
+        self.ops.append(('lookup', node.identifier))
+
+    def visit_Factor(self, node):
+        if isinstance(node.value, str):
+            self.ops.append(('lookup', node.value))
+
+
+def replay(ops):
+    table = p0.SymbolTable()
+    methods = {name: getattr(table, name) for name in ('enter', 'exit', 'declared_in_current',
+                                                        'declare', 'lookup')}
+    for op in ops:
+        methods[op[0]](*op[1:])
+
+
+def count_statements(tree):
+    return sum(len(node.statements) for node in AST.walk(tree) if isinstance(node, AST.Block))
+
+
+# Each phase is (name, function, unit): function(state) runs the phase once and returns
+# its result, and the throughput is state['counts'][unit] divided by the time taken.
+PHASES = [
+    ('tokenize', lambda state: p0.Lexer(state['code']).tokenize(), 'tokens'),
+    ('tokenize_fast', lambda state: p0.Lexer(state['code'], mode='fast').tokenize(), 'tokens'),
+    ('parse', lambda state: p0.Parser(state['tokens']).parse(), 'tokens'),
+    ('parse_syntax', lambda state: p0.SyntaxParser(state['tokens']).parse(), 'tokens'),
+    ('parse_parallel', lambda state: BatchParse.parse_parallel(state['code']), 'tokens'),
+    ('semantic', lambda state: SemanticAnalyzer().analyze(state['syntax_tree']), 'statements'),
+    ('symbols', lambda state: replay(state['ops']), 'operations'),
+    ('optimize', lambda state: Optimizer().optimize(state['tree']), 'statements'),
+    ('to_string', lambda state: state['tree'].to_string(), 'characters'),
+    ('dump_binary', lambda state: ASTBinary.dumps(state['tree']), 'bytes'),
+    ('load_binary', lambda state: ASTBinary.load(state['binary']), 'bytes'),
+]
+
+
+def prepare(code):
+    """Inputs the phases work on, with the counts used for throughput."""
+    tokens = p0.Lexer(code, mode='fast').tokenize()
+    tree = p0.Parser(tokens).parse()
+    ops = SymbolOps().record(tree)
+    binary = ASTBinary.dumps(tree)
+    counts = {'tokens': len(tokens), 'statements': count_statements(tree),
+              'operations': len(ops), 'characters': len(tree.to_string()), 'bytes': len(binary)}
+    return {'code': code, 'tokens': tokens, 'tree': tree, 'syntax_tree': p0.SyntaxParser(tokens).parse(),
+            'ops': ops, 'binary': binary, 'counts': counts}
+
+
+def best_time(function, state, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function, state):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(state, repeat, phases=PHASES):
+    counts = state['counts']
+    results = {}
+    for name, function, unit in phases:
+        seconds = best_time(function, state, repeat)
+        result = {'seconds': seconds, 'peak_bytes': peak_memory(function, state),
+                  f'{unit}_per_sec': counts[unit] / seconds}
+        if name == 'parse':
+            result['statements_per_sec'] = counts['statements'] / seconds
+        results[name] = result
+    return results
+
+
+def report(results):
+    for name, result in results.items():
+        rates = ', '.join(f"{value:,.0f} {key.replace('_per_sec', '')}/s"
+                          for key, value in result.items() if key.endswith('_per_sec'))
+        print(f"{name:<14} {result['seconds'] * 1000:9.1f} ms  "
+              f"peak {result['peak_bytes'] / 2**20:8.1f} MiB  {rates}")
+
+
+# Print each phase's time against the baseline; returns the phases slower by more
+# than `threshold` percent
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name:<14} (not in baseline)")
+            continue
+        change = 100 * (result['seconds'] - old['seconds']) / old['seconds']
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<14} {old['seconds'] * 1000:9.1f} ms -> {result['seconds'] * 1000:9.1f} ms"
+              f"  {change:+6.1f}%{flag}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--statements', type=int, default=20_000)
+    arg_parser.add_argument('--depth', type=int, default=2)
+    arg_parser.add_argument('--identifiers', type=int, default=50)
+    arg_parser.add_argument('--expression-length', type=int, default=4)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--save', metavar='FILE', help="write the results to a JSON baseline")
+    arg_parser.add_argument('--compare', metavar='FILE', help="compare against a JSON baseline")
+    arg_parser.add_argument('--threshold', type=float, default=10.0,
+                            help="slowdown in percent that counts as a regression (default 10)")
+    args = arg_parser.parse_args()
+
+    config = {'statements': args.statements, 'depth': args.depth, 'identifiers': args.identifiers,
+              'expression_length': args.expression_length, 'seed': args.seed}
+    state = prepare(generate_program(**config))
+    print(f"{len(state['code']):,} characters, {state['counts']['tokens']:,} tokens, "
+          f"{state['counts']['statements']:,} statements, {state['counts']['bytes']:,} bytes as binary AST")
+    optimizer = Optimizer()
+    optimizer.optimize(state['tree'])
+    print(f"optimizer: {optimizer.report()}")
+    results = run(state, args.repeat)
+    report(results)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['config'] != config:
+            print(f"warning: baseline was generated with {baseline['config']}")
+        print(f"\ncompared with {args.compare}:")
+        if compare(results, baseline, args.threshold):
+            status = 1
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'config': config, 'python': platform.python_version(),
+                       'parser_version': p0.PARSER_VERSION, 'results': results}, file, indent=2)
+        print(f"saved results to {args.save}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Concurrency stress test for reused lexers and parsers.
+
+Generates --programs programs with ProgramGen, a third of them with random characters
+overwritten so that they hit syntax and lexer errors, and parses each once with fresh
+objects as the reference. It then parses them all again from --threads threads, --rounds
+times over in a different order per thread. Each thread keeps one Lexer, Parser,
+SyntaxParser and SemanticAnalyzer for its whole run and resets them for every program,
+and the interpreter switches threads as often as it can, so a parse that picks up state
+from another input or another thread shows up as a different result.
+
+Compared per program: the tokens, tree text, messages, diagnostics and source spans of a
+parse with positions, and the messages of a syntax-only parse checked by the analyzer.
+Exits with status 1 if any result differs from the reference.
+
+Usage: python stress_concurrency.py [--programs N] [--statements S] [--threads T]
+                                    [--rounds R] [--seed S]
+"""
+import argparse
+import concurrent.futures
+import random
+import sys
+import threading
+import time
+
+import ASTNodeDefs as AST
+import Parser as p0
+from ProgramGen import generate_program
+from SemanticAnalyzer import SemanticAnalyzer
+
+
+def make_programs(count, statements, seed):
+    rng = random.Random(seed)
+    programs = []
+    for index in range(count):
+        code = generate_program(statements, seed=seed + index)
+        if index % 3 == 2:
+            chars = list(code)
+            for _ in range(5):
+                chars[rng.randrange(len(chars))] = rng.choice('{}()=+-.!x1 ')
+            code = ''.join(chars)
+        programs.append(code)
+    return programs
+
+
+# Lexer and parsers to reuse; one set per thread
+class Instances:
+    def __init__(self):
+        self.lexer = p0.Lexer('', mode='fast', positions=True)
+        self.parser = p0.Parser([('EOF', None)])
+        self.syntax_parser = p0.SyntaxParser([('EOF', None)])
+        self.analyzer = SemanticAnalyzer()
+
+
+# Everything a parse of `code` produces, as comparable values
+def parse_result(code, instances):
+    try:
+        instances.lexer.reset(code)
+        tokens = instances.lexer.tokenize()
+    except ValueError as exc:
+        return ('lexer error', str(exc))
+    parser = instances.parser
+    parser.reset(tokens, positions=(instances.lexer.starts, instances.lexer.ends))
+    tree = parser.parse()
+    spans = [node.span for node in AST.walk(tree)]
+    instances.syntax_parser.reset(tokens)
+    semantic = instances.analyzer.analyze(instances.syntax_parser.parse())
+    return (tokens, tree.to_string(), parser.messages, parser.diagnostics, spans, semantic)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--programs', type=int, default=40)
+    arg_parser.add_argument('--statements', type=int, default=60)
+    arg_parser.add_argument('--threads', type=int, default=8)
+    arg_parser.add_argument('--rounds', type=int, default=2)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    programs = make_programs(args.programs, args.statements, args.seed)
+    expected = [parse_result(code, Instances()) for code in programs]
+
+    local = threading.local()
+
+    # An exception is a result like any other, and differs from the reference
+    def work(index):
+        if not hasattr(local, 'instances'):
+            local.instances = Instances()
+        try:
+            return index, parse_result(programs[index], local.instances)
+        except Exception as exc:
+            return index, ('exception', f"{type(exc).__name__}: {exc}")
+
+    orders = []
+    for thread in range(args.threads):
+        order = list(range(len(programs))) * args.rounds
+        random.Random(args.seed + thread).shuffle(order)
+        orders.append(order)
+    jobs = [index for round_robin in zip(*orders) for index in round_robin]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    start = time.perf_counter()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(work, jobs))
+    finally:
+        sys.setswitchinterval(interval)
+    elapsed = time.perf_counter() - start
+
+    mismatches = sorted({index for index, result in results if result != expected[index]})
+    errors = sum(1 for result in expected if result[0] == 'lexer error' or result[2])
+    print(f"{len(results):,} parses of {len(programs)} programs ({errors} with errors) "
+          f"on {args.threads} threads in {elapsed:.2f} s")
+    if mismatches:
+        print(f"FAILED: results differ for programs {mismatches}")
+        return 1
+    print("all results identical to the serial reference")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,33 +1,381 @@
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+
+import ASTBinary
+import BatchParse
+import BytecodeVM
 import Parser as p0
+from ASTArena import Arena, ArenaBuilder
+from AsyncParse import ParseService
+from Incremental import IncrementalParser
+from Optimizer import Optimizer
+from ParseCache import ParseCache
+from SemanticAnalyzer import SemanticAnalyzer, merge_diagnostics
+
+# One lexer and one parser reset for every test, which must give the same results as
+# fresh ones
+reused_lexer = p0.Lexer('', mode="fast", positions=True)
+reused_parser = p0.Parser(reused_lexer.tokenize())
+
+# Other programs sharing the parse cache with each test input
+CACHE_FILLERS = ('int x = 1', 'float y = 2.5')
+
+# Programs that must stop with an ExecutionError on the VM and in the tree interpreter,
+# optimized or not, with the message each must give
+FAILING_PROGRAMS = {
+    'int a = 1 / 0': "Division by zero",
+    'int z = 0 int a = 5 / z': "Division by zero",
+    'float f = 1.5 / 0.0': "Division by zero",
+    'float f = 10000000000.0 int i = 0 while i < 40 { f = f * 10000000000.0 i = i + 1 } int a = f':
+        "Cannot convert an infinite or NaN float to int",
+}
+
+# Program whose syntax and semantic errors interleave, for merging the messages of the
+# separate passes
+MIXED_ERRORS = '''
+int a = 1
+b = 2
+int c = = 3
+float d = a
+if a > { int e = 2.5 }
+int f = d
+'''
+
+# Text inserted by the random incremental edits
+EDIT_TEXTS = ('', ' ', '\n', 'x = 2\n', 'int q = 1\n', '{ ', '} ', 'if a > 1 {\n',
+              'float a = 2.5 ', 'b + 1 ', '\n  }\n')
+
+
+# Results of a ParseService with one slot: three concurrent calls for `source`, which share
+# one parse, then a call that times out at once and one that is cancelled, after each of
+# which the slot must come back for the next call to finish
+async def service_results(source):
+    async with ParseService(max_workers=1, max_in_flight=1) as service:
+        results = await asyncio.gather(*(service.parse(source) for _ in range(3)))
+        try:
+            await service.parse(source + ' ', timeout=0)
+        except TimeoutError:
+            pass
+        results.append(await asyncio.wait_for(service.parse(source), 10))
+        cancelled = asyncio.ensure_future(service.parse(source + '  '))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        results.append(await asyncio.wait_for(service.parse(source), 10))
+        stats = service.stats()
+        return results, (stats['shared'], stats['timeouts'], stats['cancelled'])
+
+
+# The tree of an arena loaded back from a dump, or None when its columns or values differ
+# from those of the arena it was dumped from
+def same_arena(loaded, arena):
+    for name, column in arena.columns().items():
+        if list(loaded.columns()[name]) != list(column):
+            return None
+    if loaded.values != arena.values:
+        return None
+    return loaded.to_tree().to_string()
 
-count = 0
+
+# What running `tree` gives with each of the VM, the tree interpreter and the VM on the
+# optimized tree: (variables, builtin calls), or the message of the ExecutionError raised
+def run_outcomes(tree):
+    runs = (lambda: (BytecodeVM.VM(), BytecodeVM.Compiler().compile(tree)),
+            lambda: (BytecodeVM.TreeInterpreter(), tree),
+            lambda: (BytecodeVM.VM(), BytecodeVM.Compiler().compile(Optimizer().optimize(tree))))
+    outcomes = []
+    for run in runs:
+        runner, program = run()
+        try:
+            outcomes.append((runner.run(program), runner.output))
+        except BytecodeVM.ExecutionError as error:
+            outcomes.append(str(error))
+    return outcomes
 
 
 def test_parser(test_input, expected_output):
     """
     This function runs the lexer and parser on the test input,
-    compares the parsed AST with the expected output, and returns the result.
+    compares the parsed AST with the expected output, and returns
+    whether the test passed.
     """
-    global count
     # Initialize the lexer and tokenize the input
     lexer = p0.Lexer(test_input)
     tokens = lexer.tokenize()
     print(tokens)
+    # The fast lexer must agree token for token with the reference lexer
+    fast_tokens = p0.Lexer(test_input, mode="fast").tokenize()
+    if fast_tokens != tokens:
+        print("Test failed.")
+        print("Fast lexer output differs:")
+        print(fast_tokens)
+        return False
     # Initialize the parser and generate the AST
     parser = p0.Parser(tokens)
     ast = parser.parse()
 
     result = parser.messages
+
+    # Parsing straight from the streaming lexer, with source spans tracked, must give the
+    # same tree and messages
+    stream_lexer = p0.Lexer(test_input, mode="fast", positions=True)
+    stream_parser = p0.Parser(stream_lexer.iter_tokens(),
+                              positions=(stream_lexer.starts, stream_lexer.ends))
+    stream_ast = stream_parser.parse()
+    if stream_parser.messages != result or stream_ast.to_string() != ast.to_string():
+        print("Test failed.")
+        print("Streaming parse differs:")
+        print(stream_parser.messages)
+        return False
+
+    # Line and column lookups must agree with counting newlines, for str and bytes input
+    lines = stream_lexer.line_index()
+    byte_lines = p0.LineIndex(test_input.encode('ascii'))
+    for offset in stream_lexer.starts:
+        expected = (test_input.count('\n', 0, offset) + 1,
+                    offset - test_input.rfind('\n', 0, offset))
+        if lines.location(offset) != expected or byte_lines.location(offset) != expected:
+            print("Test failed.")
+            print(f"Line index gives {lines.location(offset)} for offset {offset}, expected {expected}")
+            return False
+
+    # Bytes, memoryview and memory-mapped input must lex like the str, positions included
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input.txt')
+        with open(path, 'wb') as file:
+            file.write(test_input.encode('ascii'))
+        for mode in ("standard", "fast"):
+            text_lexer = p0.Lexer(test_input, mode=mode, positions=True)
+            expected = (text_lexer.tokenize(), list(text_lexer.starts), list(text_lexer.ends))
+            for name, buffer_lexer in (("bytes", p0.Lexer(test_input.encode('ascii'), mode=mode, positions=True)),
+                                       ("memoryview", p0.Lexer(memoryview(test_input.encode('ascii')),
+                                                               mode=mode, positions=True)),
+                                       ("file", p0.Lexer.from_file(path, mode=mode, positions=True))):
+                with buffer_lexer:
+                    got = (buffer_lexer.tokenize(), list(buffer_lexer.starts), list(buffer_lexer.ends))
+                if got != expected:
+                    print("Test failed.")
+                    print(f"Lexing {name} input in {mode} mode differs:")
+                    print(got[0])
+                    return False
+
+    # A syntax-only parse followed by the separate semantic pass must agree as well
+    syntax_ast = p0.SyntaxParser(tokens).parse()
+    semantic_messages = SemanticAnalyzer().analyze(syntax_ast)
+    if semantic_messages != result or syntax_ast.to_string() != ast.to_string():
+        print("Test failed.")
+        print("Separate semantic analysis differs:")
+        print(semantic_messages)
+        return False
+
+    # Merged by their spans, the messages of the two passes must come in Parser's order,
+    # under Parser's error cap
+    for code in (test_input, MIXED_ERRORS):
+        code_lexer = p0.Lexer(code, positions=True)
+        code_tokens = code_lexer.tokenize()
+        positions = (code_lexer.starts, code_lexer.ends)
+        for max_errors in (p0.MAX_ERRORS, 2, 0):
+            capped_parser = p0.Parser(code_tokens, positions=positions, max_errors=max_errors)
+            capped_parser.parse()
+            split_parser = p0.SyntaxParser(code_tokens, positions=positions, max_errors=None)
+            split_analyzer = SemanticAnalyzer(max_errors=None)
+            split_analyzer.analyze(split_parser.parse())
+            merged = merge_diagnostics(split_parser.diagnostics, split_analyzer.diagnostics, max_errors)
+            if [diagnostic.message for diagnostic in merged] != capped_parser.messages:
+                print("Test failed.")
+                print(f"Merged messages differ with max_errors={max_errors}:")
+                print([diagnostic.message for diagnostic in merged])
+                return False
+
+    # The parser and the separate semantic pass must trace the same events, with every
+    # scope left in the order it was entered
+    events = []
+    p0.Parser(tokens, tracer=lambda event, **fields: events.append((event, fields))).parse()
+    analyzer_events = []
+    SemanticAnalyzer(tracer=lambda event, **fields: analyzer_events.append((event, fields))).analyze(
+        p0.SyntaxParser(tokens).parse())
+    open_scopes = []
+    for event, fields in events:
+        if event == 'scope_enter':
+            open_scopes.append(fields['scope'])
+        elif event == 'scope_exit' and (not open_scopes or open_scopes.pop() != fields['scope']):
+            open_scopes.append(None)
+            break
+    if analyzer_events != events or open_scopes:
+        print("Test failed.")
+        print("Tracer events differ:")
+        print(events)
+        return False
+
+    # PARSER_TRACE must print those events for parsers without a tracer, and nothing for
+    # ones with tracing turned off
+    traced, untraced = io.StringIO(), io.StringIO()
+    saved_trace = os.environ.get(p0.TRACE_ENV_VAR)
+    os.environ[p0.TRACE_ENV_VAR] = '1'
+    try:
+        with contextlib.redirect_stdout(traced):
+            p0.Parser(tokens).parse()
+        with contextlib.redirect_stdout(untraced):
+            p0.Parser(tokens, tracer=False).parse()
+    finally:
+        if saved_trace is None:
+            del os.environ[p0.TRACE_ENV_VAR]
+        else:
+            os.environ[p0.TRACE_ENV_VAR] = saved_trace
+    expected_trace = io.StringIO()
+    with contextlib.redirect_stdout(expected_trace):
+        for event, fields in events:
+            p0.print_tracer(event, **fields)
+    if traced.getvalue() != expected_trace.getvalue() or untraced.getvalue():
+        print("Test failed.")
+        print(f"{p0.TRACE_ENV_VAR} output differs:")
+        print(traced.getvalue())
+        return False
+
+    # Reused instances must not carry anything over from the previous test
+    reused_lexer.reset(test_input)
+    reused_tokens = reused_lexer.tokenize()
+    reused_parser.reset(reused_tokens, positions=(reused_lexer.starts, reused_lexer.ends))
+    reused_ast = reused_parser.parse()
+    reused_starts = list(reused_lexer.starts)
+    if reused_tokens != tokens or reused_lexer.tokenize() != tokens or \
+            list(reused_lexer.iter_tokens()) != tokens or list(reused_lexer.starts) != reused_starts or \
+            reused_parser.messages != result or reused_ast.to_string() != ast.to_string():
+        print("Test failed.")
+        print("Reused lexer and parser differ:")
+        print(reused_parser.messages)
+        return False
+
+    # Parsing in pieces, cut before every top-level statement line, must agree as well
+    parallel_ast, parallel_messages = BatchParse.parse_parallel(test_input, workers=2, piece_size=1)
+    if parallel_messages != result or parallel_ast.to_string() != ast.to_string():
+        print("Test failed.")
+        print("Parallel parse differs:")
+        print(parallel_messages)
+        return False
+
+    # Random edits at whitespace, each made and then undone incrementally, must match a
+    # full parse of the edited text at every step and end with the original tree
+    rng = random.Random(test_input)
+    document = IncrementalParser(test_input)
+    for _ in range(20):
+        cuts = [index for index in range(len(test_input) + 1)
+                if index in (0, len(test_input)) or test_input[index - 1].isspace()]
+        start, end = sorted(rng.sample(cuts, 2)) if rng.random() < 0.5 else [rng.choice(cuts)] * 2
+        text = rng.choice(EDIT_TEXTS)
+        removed = test_input[start:end]
+        for edit in ((start, end, text), (start, start + len(text), removed)):
+            edit_ast, edit_messages = document.edit(*edit)
+            full_parser = p0.Parser(p0.Lexer(document.source).tokenize(), max_errors=None)
+            full_ast = full_parser.parse()
+            if edit_messages != full_parser.messages or edit_ast.to_string() != full_ast.to_string():
+                print("Test failed.")
+                print(f"Incremental edit {edit} differs from a full parse:")
+                print(edit_messages)
+                return False
+    if document.messages != result or document.ast.to_string() != ast.to_string():
+        print("Test failed.")
+        print("Undone incremental edits differ")
+        return False
+
+    # The cache must evict the least recently used entry, count what it does, serve a new
+    # instance from disk and treat a corrupt file as a miss, giving the same result each time
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(max_entries=2, directory=directory)
+        cached = [cache.parse(test_input), cache.parse(CACHE_FILLERS[0]), cache.parse(test_input),
+                  cache.parse(CACHE_FILLERS[1])]
+        warm = ParseCache(directory=directory)
+        cached.append(warm.parse(test_input))
+        with open(os.path.join(directory, warm.key(test_input) + '.pickle'), 'wb') as file:
+            file.write(b'corrupt')
+        cold = ParseCache(directory=directory)
+        cached.append(cold.parse(test_input))
+        stats = (cache.stats(), warm.stats()['disk_hits'], cold.stats()['misses'])
+        expected_stats = ({'hits': 1, 'disk_hits': 0, 'misses': 3, 'evictions': 1, 'entries': 2}, 1, 1)
+        if stats != expected_stats or \
+                list(cache.entries) != [cache.key(test_input), cache.key(CACHE_FILLERS[1])] or \
+                any((cached[index][0].to_string(), cached[index][1]) != (ast.to_string(), result)
+                    for index in (0, 2, 4, 5)):
+            print("Test failed.")
+            print("Parse cache differs:")
+            print(stats)
+            return False
+
+    # The parse service must share, time out and cancel calls without losing its one slot
+    service_trees, service_stats = asyncio.run(service_results(test_input))
+    if service_stats != (2, 1, 1) or \
+            any((tree.to_string(), messages) != (ast.to_string(), result) for tree, messages in service_trees):
+        print("Test failed.")
+        print("Parse service differs:")
+        print(service_stats)
+        return False
+
+    # An arena built by the parser must dump and load back, from bytes and from a mapped
+    # file, to the same columns and the same tree
+    arena = p0.Parser(tokens, builder=ArenaBuilder()).parse()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tree.arena')
+        with open(path, 'wb') as file:
+            arena.dump(file)
+        with open(path, 'rb') as file:
+            data = file.read()
+        mapping = p0.map_file(path)
+        try:
+            # The loaded arenas are dropped before the mapping they point into is closed
+            loaded_trees = [same_arena(Arena.load(data), arena), same_arena(Arena.load(mapping), arena)]
+        finally:
+            mapping.close()
+    for loaded_tree in loaded_trees:
+        if loaded_tree != ast.to_string():
+            print("Test failed.")
+            print("Arena dump and load differs:")
+            print(loaded_tree)
+            return False
+
+    # The binary encoding must load back to the same tree
+    if ASTBinary.load(ASTBinary.dumps(ast)).to_string() != ast.to_string():
+        print("Test failed.")
+        print("Binary AST round trip differs")
+        return False
+
+    # Programs the compiler accepts must run the same on the VM as in the tree interpreter
+    try:
+        program = BytecodeVM.Compiler().compile(ast)
+    except BytecodeVM.CompileError:
+        program = None
+    if program is not None:
+        vm_outcome, interpreter_outcome, optimized_outcome = run_outcomes(ast)
+        if vm_outcome != interpreter_outcome:
+            print("Test failed.")
+            print("Bytecode VM differs from the tree interpreter")
+            return False
+        # ... and the same again after constant folding
+        if optimized_outcome != vm_outcome:
+            print("Test failed.")
+            print("Optimized program runs differently")
+            return False
+
+    # Run-time errors must surface as ExecutionError everywhere
+    for failing_program, message in FAILING_PROGRAMS.items():
+        outcomes = run_outcomes(p0.Parser(p0.Lexer(failing_program).tokenize()).parse())
+        if outcomes != [message] * 3:
+            print("Test failed.")
+            print(f"Running {failing_program!r} gives {outcomes}")
+            return False
+
     # Compare the result with the expected output
     if result == expected_output:
         print("Test passed.")
-        count += 1
-    else:
-        print("Test failed.")
-        print("Expected:")
-        print(expected_output)
-        print("Got:")
-        print(result)
+        return True
+    print("Test failed.")
+    print("Expected:")
+    print(expected_output)
+    print("Got:")
+    print(result)
+    return False
 
 
 # Testcase 1
@@ -38,9 +386,7 @@ def test1():
     '''
 
     correctMessages = ['Type Mismatch between int and float']
-    if test_parser(text1, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text1, correctMessages)
 
 # Testcase 2: Redeclaration in nested block
 
@@ -57,9 +403,7 @@ def test2():
     '''
     correctMessages = [
         'Variable a has already been declared in the current scope']
-    if test_parser(text2, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text2, correctMessages)
 
 # Testcase 3: Type mismatch in nested blocks
 
@@ -78,9 +422,7 @@ def test3():
     '''
     correctMessages = ['Type Mismatch between int and float',
                        'Type Mismatch between float and int']
-    if test_parser(text3, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text3, correctMessages)
 
 # Testcase 4: Use of undeclared variable and redeclaration in nested loop
 
@@ -96,9 +438,7 @@ def test4():
     correctMessages = ['Variable x has not been declared in the current or any enclosing scopes',
                        'Variable y has not been declared in the current or any enclosing scopes',
                        ]
-    if test_parser(text4, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text4, correctMessages)
 
 # Testcase 5: Type mismatch in while loop and nested if
 
@@ -126,9 +466,7 @@ def test5():
     '''
     correctMessages = ['Type Mismatch between float and int',
                        'Type Mismatch between float and int']
-    if test_parser(text5, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text5, correctMessages)
 
 # Testcase 6: Multiple type mismatches and undeclared variable
 
@@ -154,9 +492,7 @@ def test6():
         'Type Mismatch between int and float',
         'Type Mismatch between int and float'
     ]
-    if test_parser(text6, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text6, correctMessages)
 
 # Testcase 7: Valid code with nested blocks
 
@@ -185,9 +521,7 @@ def test7():
     }
     '''
     correctMessages = []
-    if test_parser(text7, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text7, correctMessages)
 
 
 def test8():
@@ -204,21 +538,11 @@ def test8():
     '''
     correctMessages = [
         'Variable c has not been declared in the current or any enclosing scopes']
-    if test_parser(text10, correctMessages) == 0:
-        return 1
-    return 0
+    return test_parser(text10, correctMessages)
 
 
 # Running all tests and counting passes
-passed = 0
-test1()
-test2()
-test3()
-test4()
-test5()
-test6()
-test7()
-test8()
+count = sum(test() for test in (test1, test2, test3, test4, test5, test6, test7, test8))
 print(count)
 
 if count == 8: